@@ -5,26 +5,80 @@
 # - API key otomatis dari secrets/env (GEMINI_API_KEY/GOOGLE_API_KEY)
 # - Model 2.5 (Pro/Flash/Flash-Lite) + fallback cerdas & deteksi kuota 429 limit:0
 # - JSON-mode (response_schema) -> keluaran JSON valid
+# - Context caching Gemini untuk codebook (prefix statis tidak dikirim ulang)
 # - Screening & Scope fields; QC otomatis (auto-NA bila evidence kosong)
-# - Multi-row (split-case), verifikasi per baris, ekspor CSV/JSON
+# - Multi-row (split-case), verifikasi per baris (fragment, tanpa rerun seluruh app), ekspor CSV/JSON
+# - Streaming: baris pertama bisa diverifikasi selagi sisa baris masih dihasilkan
+# - Batch multi-artikel (unggah beberapa file) -> codebook sekali per batch, batch paralel
+# - Cache exact-match (SQLite WAL, lintas sesi) -> artikel identik tidak memanggil API lagi
+# - Cache semantik (embedding) -> artikel hampir identik memakai hasil sebelumnya
 # - Patch: isi "NA" untuk kolom teks kosong, konsistensi anchors/evidence,
 #          dan sanitasi DataFrame sebelum tampil/ekspor.
 # ------------------------------------------------------------
 
+import gzip
+import io
 import os
-import json
+import re
+import time
+import unicodedata
+import random
+import datetime
+import mmap
+import sqlite3
+import hashlib
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from typing import List, Optional, Dict, Any, Tuple
+import fastjsonschema
+import numpy as np
+import orjson
 import pandas as pd
 import streamlit as st
 import google.generativeai as genai
+from google.api_core import exceptions as gexc
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 st.set_page_config(page_title="Asisten Koding Otomatis — Codebook v1.1 (Strict QC)", layout="wide")
 
+# =========================
+# Settings (secrets -> env -> default)
+# =========================
+def get_setting(name: str, default: str = "") -> str:
+    if name in st.secrets:
+        return str(st.secrets[name]).strip()
+    return (os.environ.get(name) or default).strip()
+
 # =========================
 # Load Codebook
 # =========================
-@st.cache_data(show_spinner=False)
-def load_codebook_text() -> str:
+def _mmap_readonly(fileno: int) -> mmap.mmap:
+    # Linux: MAP_POPULATE -> kernel mem-prefault semua halaman sekaligus (tanpa page fault per halaman
+    # saat decode/hash). Platform lain (macOS/Windows) tanpa flag ini -> mmap read-only biasa.
+    populate = getattr(mmap, "MAP_POPULATE", 0)
+    if populate:
+        return mmap.mmap(fileno, 0, flags=mmap.MAP_SHARED | populate, prot=mmap.PROT_READ)
+    return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+
+_INNER_WS_RUN_RE = re.compile(r"(?<=\S)[ \t]{2,}(?=\S)")
+_TRAILING_WS_RE = re.compile(r"[ \t]+$", re.M)
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+def compact_codebook(text: str) -> str:
+    # Pemadatan lossless untuk token: spasi/tab beruntun di tengah baris -> satu spasi, spasi di akhir
+    # baris dibuang, >2 baris kosong -> satu baris kosong. Indentasi awal baris (list bertingkat) dipertahankan.
+    text = _INNER_WS_RUN_RE.sub(" ", text)
+    text = _TRAILING_WS_RE.sub("", text)
+    return _BLANK_LINES_RE.sub("\n\n", text).strip("\n")
+
+@st.cache_resource(show_spinner=False)
+def load_codebook() -> Tuple[str, str]:
+    """
+    Return (teks codebook, hash codebook). File dibaca via mmap, dipadatkan
+    (compact_codebook) dan di-hash sekali per proses; hash dipakai sebagai
+    diskriminator kunci cache sehingga teks codebook tidak di-hash per request.
+    """
     cb_path = ""
     if "CODEBOOK_PATH" in st.secrets:
         cb_path = str(st.secrets["CODEBOOK_PATH"]).strip()
@@ -38,17 +92,20 @@ def load_codebook_text() -> str:
 
     for path in candidates:
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                content = f.read().strip()
+            with open(path, "rb") as f, _mmap_readonly(f.fileno()) as mm:
+                content = compact_codebook(mm[:].decode("utf-8"))
                 if content:
-                    return content
+                    # Hash atas teks yang benar-benar dikirim (setelah pemadatan), bukan byte file mentah
+                    return content, hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
         except FileNotFoundError:
             continue
+        except ValueError:
+            continue  # file kosong tidak bisa di-mmap
         except Exception as e:
             st.warning(f"Gagal membaca Codebook dari '{path}': {e}")
-    return ""
+    return "", ""
 
-CODEBOOK_TEXT = load_codebook_text()
+CODEBOOK_TEXT, CODEBOOK_HASH = load_codebook()
 if not CODEBOOK_TEXT:
     st.error("File **codebook_llm.txt** tidak ditemukan/kosong. Letakkan file di direktori app atau set CODEBOOK_PATH.")
     st.stop()
@@ -157,6 +214,80 @@ DEFAULT_GENERATION_CONFIG: Dict[str, Any] = {
     "response_schema": SCHEMA
 }
 
+BATCH_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "documents": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "doc_id": {"type": "string"},
+                    "rows": SCHEMA["properties"]["rows"]
+                },
+                "required": ["doc_id", "rows"]
+            }
+        }
+    },
+    "required": ["documents"]
+}
+
+# Validator JSON-Schema dikompilasi sekali saat import (dipakai ulang tiap respons)
+VALIDATORS: Dict[str, Any] = {
+    "rows": fastjsonschema.compile(SCHEMA),
+    "documents": fastjsonschema.compile(BATCH_SCHEMA),
+}
+ROW_VALIDATOR = fastjsonschema.compile(SCHEMA["properties"]["rows"]["items"])
+
+BATCH_GENERATION_CONFIG: Dict[str, Any] = {**DEFAULT_GENERATION_CONFIG, "response_schema": BATCH_SCHEMA}
+
+# Generation config per bentuk output (key sama dengan VALIDATORS)
+GENERATION_CONFIGS: Dict[str, Dict[str, Any]] = {
+    "rows": DEFAULT_GENERATION_CONFIG,
+    "documents": BATCH_GENERATION_CONFIG,
+}
+BATCH_MAX_INPUT_TOKENS = 60_000  # batas per request (estimasi); batch di atasnya dipecah otomatis
+
+PROMPT_RULES = """
+SYSTEM:
+You are an exacting academic coding assistant. Follow the CODEBOOK and output ONLY JSON per the provided schema.
+
+TASK:
+Read [ARTICLE] and fill the JSON fields strictly. Use ONLY evidence from the text.
+Rules:
+- SCREENING & SCOPE: decide I1–I3/E1–E2 and scope_decision using the scope safeguard. If the unit of analysis is not village/community and no dedicated village module exists, set scope_decision='Exclude' and justify.
+- Verbatim fields must copy exactly and include page/section anchors if present (e.g., “...” p. 12; Fig. 2).
+- Use pipe '|' for multi-value tokens (e.g., purpose_tokens, tags).
+- If evidence is insufficient after two careful passes, choose 'NA' and explain briefly in 'notes'.
+- If you infer from strong contextual cues, set inferred='Yes' and justify in the relevant *_evidence.
+""".strip()
+
+# Template prompt dibangun sekali di level modul; per panggilan hanya diisi via format_map.
+# Bagian statis (rules + codebook) selalu menjadi prefix yang sama -> cocok untuk context cache.
+CODEBOOK_TPL = "CODEBOOK FULL:\n---\n{codebook}\n---"
+PROMPT_TPL = "{rules}\n\n{codebook}\n\n{task}"
+
+TASK_TPL = """
+OUTPUT RULES:
+- Return an object with key "rows": a list of row objects (ALWAYS a list).
+- Each row = one document (or split-case if distinct per-village evidence; then set split_case='Yes').
+
+ARTICLE:
+---
+{article}
+---
+""".strip()
+
+BATCH_TASK_TPL = """
+OUTPUT RULES:
+- Return an object with key "documents": one entry per article, in the given order.
+- Each entry has "doc_id" (the number after ===DOC) and "rows": a list of row objects (ALWAYS a list).
+- Each row = one document (or split-case if distinct per-village evidence; then set split_case='Yes').
+- Never mix evidence between articles.
+
+ARTICLES:{articles}
+""".strip()
+
 COLUMNS: List[str] = [
     # Screening & Scope
     "rrn","inclusion_I1","inclusion_I2","inclusion_I3","exclusion_E1","exclusion_E2",
@@ -172,8 +303,8 @@ COLUMNS: List[str] = [
     # Tags & QC
     "equity_tags","engagement_tags",
     "evidence_quality","inferred","notes","split_case",
-    # Original text
-    "original_text"
+    # Source (teks artikel disimpan sekali per sesi di st.session_state.articles, di-key article_id)
+    "doc_id","article_id"
 ]
 
 ENUMS: Dict[str, List[str]] = {
@@ -198,6 +329,36 @@ ENUMS: Dict[str, List[str]] = {
     "split_case": ["Yes","No"]
 }
 
+# Lookup O(1): membership (normalise_row) & posisi opsi (index= pada selectbox)
+ENUM_SET: Dict[str, frozenset] = {k: frozenset(v) for k, v in ENUMS.items()}
+ENUM_INDEX: Dict[str, Dict[str, int]] = {k: {val: i for i, val in enumerate(v)} for k, v in ENUMS.items()}
+
+# Fallback aman per kolom enum bila nilai dari AI/form tidak valid
+ENUM_FALLBACK: Dict[str, str] = {
+    "inclusion_I1": "NA", "inclusion_I2": "NA", "inclusion_I3": "NA",
+    "exclusion_E1": "No", "exclusion_E2": "No",
+    "scope_decision": "Include",
+    "unit_of_analysis": "Village/community",
+    "explicit_definition": "No", "typology_proposed": "No",
+    "axis_A": "NA", "axis_B": "NA", "axis_C": "NA",
+    "participation_level": "NA", "equity_level": "NA", "env_level": "NA",
+    "evidence_quality": "Moderate",
+    "inferred": "No", "split_case": "No"
+}
+assert ENUM_FALLBACK.keys() == ENUMS.keys()
+# normalise_row_trusted mengandalkan enum SCHEMA == ENUMS
+assert all(SCHEMA["properties"]["rows"]["items"]["properties"][k]["enum"] == v for k, v in ENUMS.items())
+
+# Kolom enum sebagai category (kategori sudah diketahui) untuk tampilan/ekspor
+CATEGORICAL_DTYPES: Dict[str, pd.CategoricalDtype] = {c: pd.CategoricalDtype(categories=v) for c, v in ENUMS.items()}
+
+# Level outcome yang wajib didukung evidence (lookup set, bukan scan list, di setiap baris)
+SCORED_LEVELS = frozenset({"1", "2", "3"})
+
+def enum_index(col: str, value: Any, default: str) -> int:
+    idx = ENUM_INDEX[col]
+    return idx.get(value, idx[default])
+
 # =========================
 # Utils & QC rules
 # =========================
@@ -220,42 +381,32 @@ def fill_na_strings(row: Dict[str, Any]) -> Dict[str, Any]:
             row[col] = "NA"
     return row
 
+def normalise_row_trusted(row: Dict[str, Any]) -> Dict[str, Any]:
+    # Jalur cepat untuk baris yang sudah lolos VALIDATORS (enum dijamin SCHEMA): hanya bentuk kolom.
+    return {c: row.get(c, "") for c in COLUMNS}
+
+ENUM_COLS: Tuple[str, ...] = tuple(ENUMS)
+
 def normalise_row(row: Dict[str, Any]) -> Dict[str, Any]:
-    out: Dict[str, Any] = {}
-    for col in COLUMNS:
-        val = row.get(col, "")
-        if col in ENUMS and val not in ENUMS[col]:
-            # Fallback aman
-            if col in ["axis_A","axis_B","axis_C","participation_level","equity_level","env_level"]:
-                val = "NA"
-            elif col in ["explicit_definition","typology_proposed"]:
-                val = "No"
-            elif col in ["inclusion_I1","inclusion_I2","inclusion_I3"]:
-                val = "NA"
-            elif col in ["exclusion_E1","exclusion_E2"]:
-                val = "No"
-            elif col == "evidence_quality":
-                val = "Moderate"
-            elif col in ["inferred","split_case"]:
-                val = "No"
-            elif col == "scope_decision":
-                val = "Include"
-            elif col == "unit_of_analysis":
-                val = "Village/community"
-        out[col] = val
+    # Bentuk kolom dulu, lalu hanya kolom enum yang dicek; nilai tidak valid -> fallback ENUM_FALLBACK.
+    # Kasus umum (semua valid) = satu comprehension + 18 lookup set, tanpa kondisi per kolom.
+    out = normalise_row_trusted(row)
+    for col in ENUM_COLS:
+        if out[col] not in ENUM_SET[col]:
+            out[col] = ENUM_FALLBACK[col]
     return out
 
-def apply_qc_rules(row: Dict[str, Any]) -> Dict[str, Any]:
+def apply_qc_rules(row: Dict[str, Any], trusted: bool = False) -> Dict[str, Any]:
     notes: List[str] = []
 
-    # 0) Normalisasi awal enum agar tidak blank
-    row = normalise_row(row)
+    # 0) Normalisasi awal enum agar tidak blank (trusted=True: baris sudah tervalidasi schema)
+    row = normalise_row_trusted(row) if trusted else normalise_row(row)
 
     # 1) Outcomes: bila level 1/2/3 tapi evidence kosong/NA -> turunkan ke NA
     for var in ["participation","equity","env"]:
         lvl = (row.get(f"{var}_level") or "NA").strip()
         ev  = (row.get(f"{var}_evidence") or "").strip()
-        if lvl in ["1","2","3"] and (ev == "" or ev.upper() == "NA"):
+        if lvl in SCORED_LEVELS and (ev == "" or ev.upper() == "NA"):
             row[f"{var}_level"] = "NA"
             notes.append(f"Auto-NA {var} (no evidence).")
 
@@ -301,8 +452,72 @@ def apply_qc_rules(row: Dict[str, Any]) -> Dict[str, Any]:
     if notes:
         row["notes"] = (row.get("notes","") + (" " if row.get("notes") else "") + "; ".join(notes)).strip()
 
-    # 8) Normalisasi final (jaga enum valid)
-    return normalise_row(row)
+    # 8) Bentuk final; aturan di atas hanya menulis nilai enum yang valid
+    return normalise_row_trusted(row)
+
+def _add_qc_note(qc: pd.Series, mask: pd.Series, text: str) -> pd.Series:
+    # Tambah catatan QC ke baris yang kena mask, dipisah "; " seperti versi per-baris
+    return qc.where(~mask, np.where(qc.eq(""), text, qc + "; " + text))
+
+def apply_qc_rules_df(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Versi vektor apply_qc_rules untuk banyak baris sekaligus (mask pandas per kolom,
+    bukan loop Python per baris). Aturan & urutan catatan identik dengan apply_qc_rules.
+    Return: DataFrame dengan tepat kolom COLUMNS.
+    """
+    out = df.reindex(columns=COLUMNS).fillna("").astype(str)
+    qc = pd.Series("", index=out.index)
+
+    def blank(col: str) -> pd.Series:
+        return out[col].str.strip().eq("")
+
+    # 0) Normalisasi enum
+    for col, opts in ENUMS.items():
+        out[col] = out[col].where(out[col].isin(opts), ENUM_FALLBACK[col])
+
+    # 1) Outcomes: level 1/2/3 tanpa evidence -> NA
+    for var in ["participation","equity","env"]:
+        ev = out[f"{var}_evidence"].str.strip()
+        mask = out[f"{var}_level"].isin(list(SCORED_LEVELS)) & (ev.eq("") | ev.str.upper().eq("NA"))
+        out.loc[mask, f"{var}_level"] = "NA"
+        qc = _add_qc_note(qc, mask, f"Auto-NA {var} (no evidence).")
+
+    # 2) Level NA -> evidence kosong diisi "NA"
+    for var in ["participation","equity","env"]:
+        out.loc[out[f"{var}_level"].eq("NA") & blank(f"{var}_evidence"), f"{var}_evidence"] = "NA"
+
+    # 3) Typology: Partial jika kriteria tidak jelas/pendek
+    td = out["typology_details"].str.lower()
+    mask = out["typology_proposed"].eq("Yes") & (
+        td.str.contains("not explicit", regex=False) | td.str.contains("tidak eksplisit", regex=False) | td.str.len().lt(40)
+    )
+    out.loc[mask, "typology_proposed"] = "Partial"
+    qc = _add_qc_note(qc, mask, "Typology set to Partial (criteria unclear).")
+
+    # 4) Scope Exclude -> axes, outcomes, anchors & evidence NA
+    mask = out["scope_decision"].eq("Exclude")
+    out.loc[mask, ["axis_A","axis_B","axis_C","participation_level","equity_level","env_level",
+                   "axis_A_anchor","axis_B_anchor","axis_C_anchor",
+                   "participation_evidence","equity_evidence","env_evidence"]] = "NA"
+    out.loc[mask & out["evidence_quality"].eq(""), "evidence_quality"] = "Low"
+    qc = _add_qc_note(qc, mask, "Excluded (scope): axes & outcomes set to NA.")
+
+    # 5) Anchors
+    for ax in ["A","B","C"]:
+        axis_na = out[f"axis_{ax}"].str.strip().isin(["", "NA"])
+        missing = ~axis_na & blank(f"axis_{ax}_anchor")
+        out.loc[axis_na | missing, f"axis_{ax}_anchor"] = "NA"
+        qc = _add_qc_note(qc, missing, f"Axis {ax} lacks anchor.")
+
+    # 6) Kolom teks wajib
+    for col in FILL_AS_NA:
+        out.loc[blank(col), col] = "NA"
+
+    # 7) Catatan QC
+    has = qc.ne("")
+    base = out["notes"]
+    out.loc[has, "notes"] = (base + np.where(base.ne(""), " ", "") + qc).str.strip()[has]
+    return out
 
 def is_free_tier_quota_zero_error(err: Exception) -> bool:
     msg = str(err).lower()
@@ -317,14 +532,42 @@ def quota_help_box(model_tried: str):
             f"- Pastikan API key berasal dari project yang benar (punya kuota)."
         )
 
+@st.cache_resource(show_spinner=False)
+def _genai_state() -> Dict[str, Any]:
+    # Key yang sedang terpasang di genai (global per proses), bukan memo per key: A -> B -> A harus konfigurasi ulang.
+    return {"key": None, "lock": threading.Lock()}
+
+def _init_genai(api_key: str) -> None:
+    # Konfigurasi hanya bila key berbeda dari yang terpasang, bukan di setiap request.
+    state = _genai_state()
+    with state["lock"]:
+        if state["key"] == api_key:
+            return
+        genai.configure(api_key=api_key)
+        # GenerativeModel & context cache terikat ke key/project: key baru (rotasi) -> buang yang di-cache.
+        get_model.clear()
+        get_cached_model.clear()
+        get_cached_codebook.clear()
+        state["key"] = api_key
+
 def configure_genai() -> bool:
     try:
-        genai.configure(api_key=get_api_key())
+        _init_genai(get_api_key())
         return True
     except Exception as e:
         st.error(f"Gagal mengonfigurasi API Google: {e}")
         return False
 
+# Routing heuristik: artikel pendek & tidak ambigu -> Flash; selebihnya -> Pro
+AUTO_MODEL = "auto"
+ROUTE_MAX_CHARS = int(get_setting("ROUTE_MAX_CHARS", "8000"))
+_HARD_CASE_RE = re.compile(r"contested|inconclusive|ambiguous")
+
+def route_model(article_text: str) -> str:
+    if len(article_text) < ROUTE_MAX_CHARS and not _HARD_CASE_RE.search(article_text.lower()):
+        return "gemini-2.5-flash"
+    return "gemini-2.5-pro"
+
 def _fallback_order_for(model_name: str) -> List[str]:
     # Fallback sesuai dua profil yang disepakati
     if model_name == "gemini-2.5-pro":
@@ -334,90 +577,878 @@ def _fallback_order_for(model_name: str) -> List[str]:
     # default (flash-lite atau lainnya)
     return ["gemini-2.5-flash-lite", "gemini-2.5-flash", "gemini-2.5-pro"]
 
-def generate_coding_draft(
-    article_text: str,
-    codebook_text: str,
-    model_name: str
-) -> Optional[Tuple[List[Dict[str, Any]], str]]:
-    """
-    Panggil Gemini dengan JSON-mode sesuai SCHEMA.
-    Fallback urutan:
-      - Pro -> Flash -> Flash-Lite
-      - Flash -> Flash-Lite -> Pro
-      - Flash-Lite -> Flash -> Pro
-    Jika 429 & limit=0: langsung coba model berikutnya (tanpa retry).
-    Return: (rows, used_model) atau None.
-    """
-    if not configure_genai():
+# =========================
+# Cache hasil (exact-match, SQLite lokal)
+# =========================
+# Naikkan SCHEMA_VERSION bila SCHEMA/prompt berubah agar entri lama tidak terpakai.
+SCHEMA_VERSION = "v1"
+# Sidik jari otomatis atas SCHEMA/BATCH_SCHEMA + teks prompt (termasuk batch): mengedit rules/template tanpa menaikkan
+# SCHEMA_VERSION tetap tidak memakai hasil lama dari cache.
+PROMPT_VERSION = hashlib.blake2b(
+    b"\0".join([orjson.dumps(SCHEMA, option=orjson.OPT_SORT_KEYS), orjson.dumps(BATCH_SCHEMA, option=orjson.OPT_SORT_KEYS),
+                 PROMPT_RULES.encode("utf-8"), TASK_TPL.encode("utf-8"), BATCH_TASK_TPL.encode("utf-8"),
+                 CODEBOOK_TPL.encode("utf-8"), PROMPT_TPL.encode("utf-8")]),
+    digest_size=6,
+).hexdigest()
+CACHE_DB_PATH = get_setting("AKO_CACHE_PATH", ".ako_cache.db")
+CACHE_TTL_S = int(float(get_setting("CACHE_TTL_DAYS", "30")) * 86400)
+
+# Kanonisasi teks artikel untuk kunci cache & embedding saja (teks asli tetap dikirim ke model/disimpan):
+# salinan artikel yang sama dari PDF/web sering hanya beda spasi, tanda kutip, atau penanda halaman.
+_PAGE_MARKER_RE = re.compile(r"^[ \t]*(?:(?:page|halaman|hal\.)[ \t]*\d+(?:[ \t]*(?:of|dari|/)[ \t]*\d+)?|\d{1,4})[ \t]*$", re.I | re.M)
+_WS_RE = re.compile(r"\s+")
+_QUOTE_MAP = str.maketrans({"\u2018": "'", "\u2019": "'", "\u201a": "'", "\u201b": "'",
+                            "\u201c": '"', "\u201d": '"', "\u201e": '"', "\u201f": '"',
+                            "\u2013": "-", "\u2014": "-", "\u00ad": None})
+
+def canon_article(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).translate(_QUOTE_MAP)
+    return _WS_RE.sub(" ", _PAGE_MARKER_RE.sub("", text)).strip()
+
+def cache_key(model_name: str, codebook_hash: str, article_text: str) -> str:
+    return hashlib.sha256(b"|".join([
+        model_name.encode("utf-8"),
+        codebook_hash.encode("utf-8"),
+        canon_article(article_text).encode("utf-8"),
+        SCHEMA_VERSION.encode("utf-8"),
+        PROMPT_VERSION.encode("utf-8"),
+    ])).hexdigest()
+
+@st.cache_resource(show_spinner=False)
+def _cache_db() -> Tuple[sqlite3.Connection, threading.Lock]:
+    # Satu koneksi per proses (dipakai lintas sesi & thread streaming) -> akses diserialisasi lock.
+    # WAL: pembaca tidak memblokir penulis; synchronous=NORMAL cukup aman untuk data cache.
+    conn = sqlite3.connect(CACHE_DB_PATH, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS exact ("
+        "key TEXT PRIMARY KEY, rows_json TEXT NOT NULL, model TEXT NOT NULL, ts INTEGER NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS sem ("
+        "id INTEGER PRIMARY KEY, emb BLOB NOT NULL, codebook_hash TEXT NOT NULL, model TEXT NOT NULL, "
+        "rows_json TEXT NOT NULL, used_model TEXT NOT NULL, ts INTEGER NOT NULL)"
+    )
+    # TTL hanya dicek saat baca -> entri kedaluwarsa dibuang sekali per proses agar file tidak tumbuh tanpa batas
+    cutoff = int(time.time()) - CACHE_TTL_S
+    conn.execute("DELETE FROM exact WHERE ts < ?", (cutoff,))
+    conn.execute("DELETE FROM sem WHERE ts < ?", (cutoff,))
+    conn.commit()
+    return conn, threading.Lock()
+
+def cache_get(key: str) -> Optional[Tuple[List[Dict[str, Any]], str]]:
+    try:
+        conn, lock = _cache_db()
+        with lock:
+            hit = conn.execute("SELECT rows_json, model, ts FROM exact WHERE key = ?", (key,)).fetchone()
+    except sqlite3.Error:
+        return None
+    if not hit or time.time() - hit[2] > CACHE_TTL_S:
         return None
+    rows = orjson.loads(hit[0])
+    # Entri kosong (respons kosong sesaat, tersimpan oleh versi lama) = miss, bukan hasil
+    return (rows, hit[1]) if rows else None
 
-    prompt = f"""
-SYSTEM:
-You are an exacting academic coding assistant. Follow the CODEBOOK and output ONLY JSON per the provided schema.
+def cache_set(key: str, rows: List[Dict[str, Any]], used_model: str) -> None:
+    try:
+        conn, lock = _cache_db()
+        with lock, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO exact (key, rows_json, model, ts) VALUES (?, ?, ?, ?)",
+                (key, orjson.dumps(rows).decode("utf-8"), used_model, int(time.time()))
+            )
+    except sqlite3.Error as e:
+        st.warning(f"Gagal menyimpan cache lokal: {e}")
 
-TASK:
-Read [ARTICLE] and fill the JSON fields strictly. Use ONLY evidence from the text.
-Rules:
-- SCREENING & SCOPE: decide I1–I3/E1–E2 and scope_decision using the scope safeguard. If the unit of analysis is not village/community and no dedicated village module exists, set scope_decision='Exclude' and justify.
-- Verbatim fields must copy exactly and include page/section anchors if present (e.g., “...” p. 12; Fig. 2).
-- Use pipe '|' for multi-value tokens (e.g., purpose_tokens, tags).
-- If evidence is insufficient after two careful passes, choose 'NA' and explain briefly in 'notes'.
-- If you infer from strong contextual cues, set inferred='Yes' and justify in the relevant *_evidence.
+# =========================
+# Cache semantik (embedding Gemini + inner product)
+# =========================
+EMBED_MODEL = "models/text-embedding-004"
+# Batas input EMBED_MODEL (~2.048 token; sisanya dipotong diam-diam). Artikel lebih panjang hanya
+# terbandingkan beberapa halaman awalnya -> cache semantik dilewati. ~3 char/token = estimasi konservatif.
+EMBED_MAX_TOKENS = 2048
+EMBED_MAX_CHARS = EMBED_MAX_TOKENS * 3
+SEMCACHE_THRESHOLD = float(get_setting("SEMCACHE_THRESHOLD", "0.98"))  # ketat: hit salah = koding artikel lain
+# Entri baru yang (hampir) identik dengan entri lama di scope yang sama menimpa entri itu (mis. paksa jalankan ulang)
+SEMCACHE_DUP_THRESHOLD = 0.999
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def codebook_digest(codebook_text: str) -> str:
+    # Codebook aplikasi sudah di-hash saat dimuat; teks lain di-hash on demand.
+    return CODEBOOK_HASH if codebook_text is CODEBOOK_TEXT else text_hash(codebook_text)
+
+def _sem_scope(codebook_hash: str) -> str:
+    # Entri semantik hanya berlaku untuk codebook + versi prompt yang sama (disimpan di kolom codebook_hash).
+    return f"{codebook_hash}:{PROMPT_VERSION}"
+
+def _sem_key_id(idx: Dict[str, Any], key: str) -> int:
+    # Key (scope|model) -> id integer, agar filter per lookup = satu perbandingan vektor NumPy.
+    return idx["key_ids"].setdefault(key, len(idx["key_ids"]))
+
+def _sem_append(idx: Dict[str, Any], emb: np.ndarray, key: str, rows_json: str, used_model: str, row_id: int) -> None:
+    # Matriks berkapasitas (tumbuh 2x saat penuh): append amortised O(d), bukan np.vstack O(N*d) per entri.
+    n = idx["n"]
+    if idx["emb"] is None:
+        idx["emb"] = np.empty((64, emb.shape[0]), dtype=np.float32)
+        idx["kid"] = np.empty(64, dtype=np.int32)
+    elif n == idx["emb"].shape[0]:
+        idx["emb"] = np.concatenate([idx["emb"], np.empty_like(idx["emb"])])
+        idx["kid"] = np.concatenate([idx["kid"], np.empty_like(idx["kid"])])
+    idx["emb"][n] = emb
+    idx["kid"][n] = _sem_key_id(idx, key)
+    idx["rows"].append((rows_json, used_model, row_id))
+    idx["n"] = n + 1
+
+@st.cache_resource(show_spinner=False)
+def _semantic_index() -> Dict[str, Any]:
+    # Matriks embedding ternormalisasi L2 (kapasitas x d, baris [:n] terisi) + metadata paralel; dimuat sekali per proses.
+    idx: Dict[str, Any] = {"emb": None, "kid": None, "n": 0, "key_ids": {}, "rows": [], "lock": threading.Lock()}
+    try:
+        conn, lock = _cache_db()
+        with lock:
+            records = conn.execute(
+                "SELECT emb, codebook_hash, model, rows_json, used_model, id FROM sem WHERE ts >= ? ORDER BY id",
+                (int(time.time()) - CACHE_TTL_S,)
+            ).fetchall()
+    except sqlite3.Error:
+        return idx
+    for rec in records:
+        emb = np.frombuffer(rec[0], dtype=np.float32)
+        if idx["emb"] is None or idx["emb"].shape[1] == emb.shape[0]:
+            _sem_append(idx, emb, f"{rec[1]}|{rec[2]}", rec[3], rec[4], rec[5])
+    return idx
+
+def embed_article(article_text: str) -> Optional[np.ndarray]:
+    if len(article_text) > EMBED_MAX_CHARS:
+        return None  # embedding hanya mewakili awal artikel; kemiripan tinggi tidak berarti hasil koding sama
+    try:
+        res = genai.embed_content(model=EMBED_MODEL, content=article_text)
+    except Exception:
+        return None  # cache semantik bersifat opsional; lanjut ke pemanggilan model
+    vec = np.asarray(res["embedding"], dtype=np.float32)
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else None
+
+def _sem_best(idx: Dict[str, Any], emb: np.ndarray, key: str) -> Tuple[int, float]:
+    # (posisi, cosine) entri termirip dalam key yang sama; (-1, -1.0) bila tidak ada. Dipanggil dengan idx["lock"].
+    n = idx["n"]
+    kid = idx["key_ids"].get(key)
+    if kid is None or n == 0 or idx["emb"].shape[1] != emb.shape[0]:
+        return -1, -1.0
+    sims = idx["emb"][:n] @ emb  # sgemv float32 atas blok kontigu
+    sims[idx["kid"][:n] != kid] = -1.0
+    best = int(np.argmax(sims))
+    return best, float(sims[best])
+
+def semantic_cache_get(
+    emb: np.ndarray, codebook_hash: str, model_name: str
+) -> Optional[Tuple[List[Dict[str, Any]], str, float]]:
+    idx = _semantic_index()
+    with idx["lock"]:
+        best, score = _sem_best(idx, emb, f"{_sem_scope(codebook_hash)}|{model_name}")
+        if score < SEMCACHE_THRESHOLD:
+            return None
+        rows_json, used_model, _ = idx["rows"][best]
+    rows = orjson.loads(rows_json)
+    return (rows, used_model, score) if rows else None
+
+def semantic_cache_add(
+    emb: np.ndarray, codebook_hash: str, model_name: str, rows: List[Dict[str, Any]], used_model: str
+) -> None:
+    rows_json = orjson.dumps(rows).decode("utf-8")
+    scope = _sem_scope(codebook_hash)
+    key = f"{scope}|{model_name}"
+    emb = emb.astype(np.float32, copy=False)
+    idx = _semantic_index()
+    with idx["lock"]:
+        best, score = _sem_best(idx, emb, key)
+    # Upsert: artikel yang sama dikodekan ulang (paksa jalankan ulang) menimpa entrinya, bukan menambah baris baru
+    dup = best if score >= SEMCACHE_DUP_THRESHOLD else -1
+    try:
+        conn, lock = _cache_db()
+        with lock, conn:
+            if dup >= 0:
+                row_id = idx["rows"][dup][2]
+                conn.execute(
+                    "UPDATE sem SET emb = ?, rows_json = ?, used_model = ?, ts = ? WHERE id = ?",
+                    (emb.tobytes(), rows_json, used_model, int(time.time()), row_id)
+                )
+            else:
+                row_id = conn.execute(
+                    "INSERT INTO sem (emb, codebook_hash, model, rows_json, used_model, ts) VALUES (?, ?, ?, ?, ?, ?)",
+                    (emb.tobytes(), scope, model_name, rows_json, used_model, int(time.time()))
+                ).lastrowid
+    except sqlite3.Error as e:
+        st.warning(f"Gagal menyimpan cache semantik: {e}")
+        return
+    with idx["lock"]:
+        if dup >= 0:
+            idx["emb"][dup] = emb
+            idx["rows"][dup] = (rows_json, used_model, row_id)
+        elif idx["emb"] is None or idx["emb"].shape[1] == emb.shape[0]:
+            _sem_append(idx, emb, key, rows_json, used_model, row_id)
 
-CODEBOOK FULL:
----
-{codebook_text}
----
+# =========================
+# Context caching (codebook statis di sisi server Gemini)
+# =========================
+CONTEXT_CACHE_ENABLED = get_setting("CONTEXT_CACHE", "1") != "0"
+CONTEXT_CACHE_TTL_S = 3600
+
+def codebook_prompt(codebook_text: str) -> str:
+    return CODEBOOK_TPL.format_map({"codebook": codebook_text})
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def prompt_prefix(codebook_hash: str, _codebook_text: str) -> str:
+    # Prefix statis (rules + codebook) dibangun sekali per codebook; per request tinggal ditambah task prompt.
+    # cache_resource (bukan cache_data) agar string multi-KB tidak disalin/di-pickle tiap akses.
+    return PROMPT_TPL.format_map({"rules": PROMPT_RULES, "codebook": codebook_prompt(_codebook_text), "task": ""})
+
+@st.cache_resource(show_spinner=False, ttl=CONTEXT_CACHE_TTL_S - 300)
+def get_cached_codebook(codebook_hash: str, model_name: str, _codebook_text: str) -> Optional[Any]:
+    # Di-key oleh sha256(codebook): codebook berubah -> cache baru. Handle lokal kedaluwarsa
+    # sebelum TTL server. None (mis. codebook di bawah minimum token cache) juga di-cache
+    # agar tidak mencoba ulang di setiap request.
+    try:
+        return genai.caching.CachedContent.create(
+            model=f"models/{model_name}",
+            display_name=f"ako-codebook-{codebook_hash[:12]}",
+            system_instruction=PROMPT_RULES,
+            contents=[codebook_prompt(_codebook_text)],
+            ttl=datetime.timedelta(seconds=CONTEXT_CACHE_TTL_S),
+        )
+    except Exception:
+        return None
 
-OUTPUT RULES:
-- Return an object with key "rows": a list of row objects (ALWAYS a list).
-- Each row = one document (or split-case if distinct per-village evidence; then set split_case='Yes').
+@st.cache_resource(show_spinner=False)
+def get_model(model_name: str, list_key: str = "rows", schema_version: str = SCHEMA_VERSION) -> Any:
+    # Satu GenerativeModel per (model, bentuk output, versi schema); dipakai ulang lintas rerun.
+    return genai.GenerativeModel(model_name=model_name, generation_config=GENERATION_CONFIGS[list_key])
+
+@st.cache_resource(show_spinner=False, ttl=CONTEXT_CACHE_TTL_S - 300)
+def get_cached_model(cache_name: str, list_key: str, _cc: Any) -> Any:
+    return genai.GenerativeModel.from_cached_content(cached_content=_cc, generation_config=GENERATION_CONFIGS[list_key])
+
+def _build_request(codebook_text: str, task_prompt: str, model_name: str, list_key: str) -> Tuple[Any, str]:
+    # Dengan context cache hanya task_prompt (output rules + artikel) yang dikirim.
+    if CONTEXT_CACHE_ENABLED:
+        cc = get_cached_codebook(codebook_digest(codebook_text), model_name, codebook_text)
+        if cc is not None:
+            return get_cached_model(cc.name, list_key, cc), task_prompt
+    return get_model(model_name, list_key), prompt_prefix(codebook_digest(codebook_text), codebook_text) + task_prompt
+
+MAX_CONCURRENCY = int(get_setting("MAX_CONCURRENCY", "8"))
+BACKOFF_MAX_ATTEMPTS = 4
+BACKOFF_MAX_DELAY_S = 60.0  # kuota Gemini per menit: jeda dari server tidak pernah lebih dari satu jendela
+RPM_LIMIT = int(get_setting("RPM_LIMIT", "0"))  # request/menit ke provider; 0 = tanpa batas
+
+@st.cache_resource(show_spinner=False)
+def _rpm_bucket(rpm: int) -> Dict[str, Any]:
+    # Token bucket lintas sesi & thread: kapasitas = rpm, terisi rpm/60 token per detik.
+    # paused_until (monotonic): jeda bersama setelah 429, berlaku juga bila RPM_LIMIT = 0.
+    return {"lock": threading.Lock(), "tokens": float(rpm), "ts": time.monotonic(), "paused_until": 0.0}
+
+def _acquire_rpm_slot() -> None:
+    # Blok sampai jeda 429 bersama lewat dan ada satu token; mencegah batch paralel melewati kuota RPM lalu kena 429.
+    bucket = _rpm_bucket(RPM_LIMIT)
+    while True:
+        with bucket["lock"]:
+            wait = bucket["paused_until"] - time.monotonic()
+        if wait <= 0:
+            break
+        time.sleep(wait + random.random())  # jitter: worker yang menunggu tidak serentak menembak lagi
+    if RPM_LIMIT <= 0:
+        return
+    while True:
+        with bucket["lock"]:
+            now = time.monotonic()
+            bucket["tokens"] = min(float(RPM_LIMIT), bucket["tokens"] + (now - bucket["ts"]) * RPM_LIMIT / 60.0)
+            bucket["ts"] = now
+            if bucket["tokens"] >= 1.0:
+                bucket["tokens"] -= 1.0
+                return
+            wait = (1.0 - bucket["tokens"]) * 60.0 / RPM_LIMIT
+        time.sleep(wait)
+
+def _pause_requests(delay: float) -> None:
+    # Setelah 429: semua worker (lintas sesi) menunggu sampai jeda dari server habis, bukan menembak
+    # request yang pasti ditolak. Token RPM dikosongkan: yang tersedia setelah jeda hanya isi ulang selama jeda.
+    bucket = _rpm_bucket(RPM_LIMIT)
+    with bucket["lock"]:
+        now = time.monotonic()
+        bucket["paused_until"] = max(bucket["paused_until"], now + delay)
+        bucket["tokens"] = min(bucket["tokens"], 0.0)
+        bucket["ts"] = now
+
+# Petunjuk jeda dari server pada 429 ("Please retry in 23.4s" / RetryInfo "retry_delay { seconds: 23 }")
+_RETRY_DELAY_RE = re.compile(r"retry in (\d+(?:\.\d+)?)s|retry_delay\s*\{\s*seconds:\s*(\d+)", re.I)
+
+def _retry_delay(err: Exception, attempt: int) -> float:
+    # Pakai jeda dari server bila ada (lebih lama dari backoff 1/2/4 s untuk kuota per menit), selain itu eksponensial.
+    m = _RETRY_DELAY_RE.search(str(err))
+    base = float(m.group(1) or m.group(2)) if m else float(2 ** attempt)
+    return min(BACKOFF_MAX_DELAY_S, base) + random.random()
+
+# Error sementara yang layak diulang dengan prompt yang sama (429 biasa, 5xx, timeout, jaringan).
+TRANSIENT_ERRORS = (
+    gexc.ResourceExhausted, gexc.InternalServerError, gexc.ServiceUnavailable,
+    gexc.DeadlineExceeded, ConnectionError, TimeoutError,
+)
 
-ARTICLE:
----
-{article_text}
----
-    """.strip()
+def _generate_with_backoff(model: Any, prompt: str, **kwargs: Any) -> Any:
+    # Error sementara -> tunggu (jeda server atau eksponensial) + jitter lalu ulangi; 429 limit:0 langsung ke fallback.
+    for attempt in range(BACKOFF_MAX_ATTEMPTS):
+        _acquire_rpm_slot()
+        try:
+            return model.generate_content(prompt, **kwargs)
+        except TRANSIENT_ERRORS as e:
+            if is_free_tier_quota_zero_error(e) or attempt == BACKOFF_MAX_ATTEMPTS - 1:
+                raise
+            delay = _retry_delay(e, attempt)
+            if isinstance(e, gexc.ResourceExhausted):
+                _pause_requests(delay)  # _acquire_rpm_slot di attempt berikutnya menunggu jeda ini
+            else:
+                time.sleep(delay)
+
+def _send_request(codebook_text: str, task_prompt: str, model_name: str, list_key: str, **kwargs: Any) -> Any:
+    # Context cache server bisa hilang sebelum TTL lokal (dihapus/di-evict) -> NotFound.
+    # Buang handle lokal lalu ulangi sekali; _build_request membuat cache baru atau jatuh ke prompt penuh.
+    model, prompt = _build_request(codebook_text, task_prompt, model_name, list_key)
+    try:
+        return _generate_with_backoff(model, prompt, **kwargs)
+    except gexc.NotFound:
+        if not CONTEXT_CACHE_ENABLED:
+            raise
+        get_cached_codebook.clear()
+        get_cached_model.clear()
+        model, prompt = _build_request(codebook_text, task_prompt, model_name, list_key)
+        return _generate_with_backoff(model, prompt, **kwargs)
+
+def _model_error_is_fallback(err: Exception, model_try: str) -> bool:
+    # True -> lanjut ke model fallback berikutnya; False -> hentikan (error sudah ditampilkan).
+    if is_free_tier_quota_zero_error(err):
+        st.warning(f"429 limit:0 pada **{model_try}** → mencoba fallback berikutnya…")
+        return True
+    st.error(f"Kesalahan saat memakai **{model_try}**: {err}")
+    return False
+
+def _report_all_models_failed(model_name: str, last_err: Optional[Exception]) -> None:
+    st.error("Tidak bisa menghasilkan output karena kuota/akses semua model yang dicoba gagal.")
+    if last_err:
+        quota_help_box(_fallback_order_for(model_name)[0])
+        st.text_area("Detail error terakhir:", str(last_err), height=160)
+
+def _parse_json_payload(raw_json: str, list_key: str, model_try: str) -> Optional[Dict[str, Any]]:
+    # response_mime_type + response_schema (GENERATION_CONFIGS) menjamin resp.text berupa JSON murni:
+    # tidak ada ekstraksi teks; JSON rusak diperlakukan sebagai error model.
+    data = orjson.loads(raw_json)
+    try:
+        VALIDATORS[list_key](data)
+    except fastjsonschema.JsonSchemaException as e:
+        st.error(f"Struktur JSON tidak sesuai saat memakai **{model_try}**: {e.message}")
+        st.text_area("Output mentah dari AI:", raw_json, height=200)
+        return None
+    return data
 
+def _valid_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    for row in rows:
+        try:
+            out.append(ROW_VALIDATOR(row))
+        except fastjsonschema.JsonSchemaException:
+            continue  # baris tidak sesuai schema; terlapor saat validasi akhir
+    return out
+
+def _generate_json(
+    codebook_text: str,
+    task_prompt: str,
+    model_name: str,
+    list_key: str
+) -> Optional[Tuple[Dict[str, Any], str]]:
+    # Loop fallback model; data dijamin lolos VALIDATORS[list_key] bila berhasil.
     last_err: Optional[Exception] = None
     for model_try in _fallback_order_for(model_name):
         try:
-            model = genai.GenerativeModel(model_name=model_try, generation_config=DEFAULT_GENERATION_CONFIG)
-            resp = model.generate_content(prompt)
+            resp = _send_request(codebook_text, task_prompt, model_try, list_key)
             raw_json = resp.text  # JSON string (response_mime_type="application/json")
-            data = json.loads(raw_json)
+            data = _parse_json_payload(raw_json, list_key, model_try)
+            return (data, model_try) if data is not None else None
 
-            if not isinstance(data, dict) or "rows" not in data or not isinstance(data["rows"], list):
-                st.error(f"Struktur JSON tidak sesuai saat memakai **{model_try}**.")
-                st.text_area("Output mentah dari AI:", raw_json, height=200)
-                return None
+        except Exception as e:
+            last_err = e
+            if _model_error_is_fallback(e, model_try):
+                continue
+            return None
 
-            return data["rows"], model_try
+    _report_all_models_failed(model_name, last_err)
+    return None
+
+# =========================
+# Streaming (baris pertama bisa diverifikasi selagi sisa baris dihasilkan)
+# =========================
+# Karakter yang mengubah state parser; karakter lain dilewati regex (C) tanpa loop Python per karakter
+_STREAM_TOKEN_RE = re.compile(r'[{}\[\]"\\]')
+
+class RowStreamParser:
+    """
+    Parser inkremental untuk {"rows": [{...}, ...]}.
+    feed(chunk) mengembalikan baris yang objeknya sudah lengkap; teks penuh tetap
+    tersedia di .text untuk validasi akhir. Hanya chunk baru yang dipindai (state
+    dibawa antar-chunk), dan chunk disimpan sebagai list -> tanpa konkatenasi string O(n^2).
+    """
+
+    def __init__(self) -> None:
+        self._parts: List[str] = []
+        self._text: Optional[str] = ""
+        self._offset = 0          # posisi absolut awal chunk berikutnya
+        self._depth = 0
+        self._in_str = False
+        self._escaped_at = -1     # posisi absolut karakter yang di-escape (setelah "\")
+        self._row: Optional[List[str]] = None  # potongan teks baris yang sedang dibaca
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = "".join(self._parts)
+        return self._text
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self._parts.append(chunk)
+        self._text = None
+        out: List[Dict[str, Any]] = []
+        base = self._offset
+        piece_start = 0 if self._row is not None else -1
+        for m in _STREAM_TOKEN_RE.finditer(chunk):
+            i = m.start()
+            ch = chunk[i]
+            if base + i == self._escaped_at:
+                continue
+            if self._in_str:
+                if ch == "\\":
+                    self._escaped_at = base + i + 1
+                elif ch == '"':
+                    self._in_str = False
+            elif ch == '"':
+                self._in_str = True
+            elif ch in "{[":
+                self._depth += 1
+                if ch == "{" and self._depth == 3:  # objek -> "rows" -> objek baris
+                    self._row = []
+                    piece_start = i
+            elif ch in "}]":
+                if ch == "}" and self._depth == 3 and self._row is not None:
+                    self._row.append(chunk[piece_start:i + 1])
+                    try:
+                        out.append(orjson.loads("".join(self._row)))
+                    except orjson.JSONDecodeError:
+                        pass  # baris rusak; validasi akhir pada .text tetap berjalan
+                    self._row = None
+                    piece_start = -1
+                self._depth -= 1
+        if self._row is not None:
+            self._row.append(chunk[piece_start:])
+        self._offset = base + len(chunk)
+        return out
+
+def new_stream_job(article_id: str, doc_id: str = "") -> Dict[str, Any]:
+    # Semua state yang berubah berupa objek mutable (list/Event) agar job bisa dibagi
+    # antar-sesi (lihat dedup_call). "finished" di-clear hanya selama thread latar membaca stream.
+    finished = threading.Event()
+    finished.set()
+    return {"rows": [], "finished": finished, "errors": [], "article_id": article_id, "doc_id": doc_id}
+
+def _chunk_text(chunk: Any) -> str:
+    try:
+        return chunk.text
+    except ValueError:
+        return ""  # chunk tanpa parts (mis. hanya finish_reason)
 
+def _generate_rows_streaming(
+    codebook_text: str,
+    task_prompt: str,
+    model_name: str,
+    job: Dict[str, Any],
+    on_complete: Any
+) -> Optional[Tuple[List[Dict[str, Any]], str]]:
+    # Fallback hanya berlaku sampai baris pertama tiba; sisanya dibaca thread latar ke job["rows"]
+    # dan langsung di-QC (prepare_rows) di thread itu, selagi pengguna memverifikasi baris sebelumnya.
+    last_err: Optional[Exception] = None
+    for model_try in _fallback_order_for(model_name):
+        try:
+            chunks = iter(_send_request(codebook_text, task_prompt, model_try, "rows", stream=True))
+            parser = RowStreamParser()
+            first: List[Dict[str, Any]] = []
+            for chunk in chunks:
+                first.extend(_valid_rows(parser.feed(_chunk_text(chunk))))
+                if first:
+                    break
         except Exception as e:
             last_err = e
-            if is_free_tier_quota_zero_error(e):
-                st.warning(f"429 limit:0 pada **{model_try}** → mencoba fallback berikutnya…")
+            if _model_error_is_fallback(e, model_try):
                 continue
-            else:
-                st.error(f"Kesalahan saat memakai **{model_try}**: {e}")
+            return None
+
+        if not first:
+            # Stream selesai tanpa satu pun baris lengkap -> validasi penuh seperti mode non-stream.
+            data = _parse_json_payload(parser.text, "rows", model_try)
+            if data is None:
                 return None
+            on_complete(data["rows"], model_try)
+            return data["rows"], model_try
 
-    st.error("Tidak bisa menghasilkan output karena kuota/akses semua model yang dicoba gagal.")
-    if last_err:
-        quota_help_box(_fallback_order_for(model_name)[0])
-        st.text_area("Detail error terakhir:", str(last_err), height=160)
+        def _finish(chunks: Any = chunks, parser: RowStreamParser = parser, used_model: str = model_try) -> None:
+            try:
+                for chunk in chunks:
+                    fresh = _valid_rows(parser.feed(_chunk_text(chunk)))
+                    if fresh:
+                        job["rows"].extend(prepare_rows(fresh, job["article_id"], job["doc_id"]))
+                data = VALIDATORS["rows"](orjson.loads(parser.text))
+                on_complete(data["rows"], used_model)
+            except Exception as e:
+                job["errors"].append(str(e))
+            finally:
+                job["finished"].set()
+
+        job["finished"].clear()
+        threading.Thread(target=_finish, daemon=True).start()
+        return first, model_try
+
+    _report_all_models_failed(model_name, last_err)
     return None
 
+# =========================
+# De-duplikasi request identik yang sedang berjalan (double-click / multi-tab)
+# =========================
+@st.cache_resource(show_spinner=False)
+def _inflight_registry() -> Dict[str, Any]:
+    # Registry lintas sesi: key -> (Future hasil leader, job stream leader)
+    return {"lock": threading.Lock(), "calls": {}}
+
+def dedup_call(key: str, fn: Any, job: Optional[Dict[str, Any]] = None) -> Tuple[Any, Optional[Dict[str, Any]], bool]:
+    """
+    Jalankan fn() sekali per key yang sedang berjalan. Pemanggil pertama (leader)
+    mengeksekusi fn di thread-nya sendiri; pemanggil berikutnya menunggu Future leader.
+    Entri stream tetap terdaftar sampai stream leader selesai agar follower bisa ikut membaca.
+    Return: (hasil, job leader, is_leader).
+    """
+    reg = _inflight_registry()
+    with reg["lock"]:
+        for k in [k for k, (f, j) in reg["calls"].items() if f.done() and (j is None or j["finished"].is_set())]:
+            del reg["calls"][k]
+        entry = reg["calls"].get(key)
+        if entry is None:
+            fut: Future = Future()
+            reg["calls"][key] = (fut, job)
+    if entry is not None:
+        fut, leader_job = entry
+        try:
+            return fut.result(), leader_job, False
+        except BaseException:
+            return fn(), job, True  # leader gagal/terinterupsi -> kerjakan sendiri
+    try:
+        result = fn()
+    except BaseException as e:
+        fut.set_exception(e)
+        with reg["lock"]:
+            reg["calls"].pop(key, None)
+        raise
+    fut.set_result(result)
+    if result is None or job is None:
+        with reg["lock"]:
+            reg["calls"].pop(key, None)
+    return result, job, True
+
+def generate_coding_draft(
+    article_text: str,
+    codebook_text: str,
+    model_name: str,
+    stream_job: Optional[Dict[str, Any]] = None,
+    force_refresh: bool = False
+) -> Optional[Tuple[List[Dict[str, Any]], str]]:
+    """
+    Panggil Gemini dengan JSON-mode sesuai SCHEMA.
+    Fallback urutan:
+      - Pro -> Flash -> Flash-Lite
+      - Flash -> Flash-Lite -> Pro
+      - Flash-Lite -> Flash -> Pro
+    Jika 429 & limit=0: langsung coba model berikutnya (tanpa retry).
+    Artikel identik (model + codebook + teks sama setelah canon_article) diambil dari cache lokal;
+    artikel hampir identik (cosine >= SEMCACHE_THRESHOLD) dari cache semantik.
+    force_refresh=True melewati kedua cache (hasil baru tetap disimpan ke cache).
+    Submit identik yang masih berjalan (double-click/tab lain) menunggu hasil yang sama.
+    Dengan stream_job (lihat new_stream_job): respons di-stream, yang dikembalikan
+    baris yang sudah lengkap, sisanya ditambahkan ke stream_job["rows"] di latar
+    (sudah melalui prepare_rows, siap masuk antrean).
+    Return: (rows, used_model) atau None.
+    """
+    key = cache_key(model_name, codebook_digest(codebook_text), article_text)
+    result, leader_job, is_leader = dedup_call(
+        f"{key}|{'stream' if stream_job is not None else 'block'}|{int(force_refresh)}",
+        lambda: _generate_coding_draft(article_text, codebook_text, model_name, stream_job, force_refresh),
+        stream_job,
+    )
+    if is_leader or result is None:
+        return result
+    st.caption("⏳ Artikel yang sama sedang/baru saja dikodekan di sesi lain; memakai hasil tersebut.")
+    if stream_job is not None and leader_job is not None:
+        # Berbagi list rows/Event/errors milik leader; article_id/doc_id tetap milik sesi ini
+        # (teks follower bisa beda spasi/kutip -> article_id lain, terdaftar hanya di sesinya sendiri).
+        stream_job.update({k: leader_job[k] for k in ("rows", "finished", "errors")})
+    rows, used_model = result
+    return [dict(r) for r in rows], used_model
+
+def _generate_coding_draft(
+    article_text: str,
+    codebook_text: str,
+    model_name: str,
+    stream_job: Optional[Dict[str, Any]],
+    force_refresh: bool
+) -> Optional[Tuple[List[Dict[str, Any]], str]]:
+    codebook_hash = codebook_digest(codebook_text)
+    key = cache_key(model_name, codebook_hash, article_text)
+    cached = None if force_refresh else cache_get(key)
+    if cached:
+        st.caption("⚡ Hasil diambil dari cache lokal (tanpa panggilan API).")
+        return cached
+
+    if not configure_genai():
+        return None
+
+    emb = embed_article(canon_article(article_text))
+    if emb is not None and not force_refresh:
+        sem_hit = semantic_cache_get(emb, codebook_hash, model_name)
+        if sem_hit:
+            rows, used_model, score = sem_hit
+            # Tidak dipromosikan ke cache exact: hit semantik bukan hasil untuk teks ini persis
+            st.caption(f"⚡ Hasil diambil dari cache semantik (kemiripan {score:.3f}).")
+            return rows, used_model
+
+    task_prompt = TASK_TPL.format_map({"article": article_text})
+
+    def _store(rows: List[Dict[str, Any]], used_model: str) -> None:
+        # 0 baris bisa jadi kegagalan sesaat: jangan dibekukan di cache selama CACHE_TTL_DAYS
+        if not rows:
+            return
+        cache_set(key, rows, used_model)
+        if emb is not None:
+            semantic_cache_add(emb, codebook_hash, model_name, rows, used_model)
+
+    if stream_job is not None:
+        return _generate_rows_streaming(codebook_text, task_prompt, model_name, stream_job, _store)
+
+    result = _generate_json(codebook_text, task_prompt, model_name, "rows")
+    if result is None:
+        return None
+    data, used_model = result
+    _store(data["rows"], used_model)
+    return data["rows"], used_model
+
+def approx_tokens(text: str) -> int:
+    # Estimasi kasar (~4 karakter/token) — cukup untuk membagi batch tanpa panggilan API.
+    return len(text) // 4 + 1
+
+# Guard konteks: artikel > article_budget(model) dipecah per section menjadi bagian <= CHUNK_MAX_TOKENS
+MODEL_MAX_INPUT_TOKENS: Dict[str, int] = {
+    "gemini-2.5-pro": 900_000,
+    "gemini-2.5-flash": 900_000,
+    "gemini-2.5-flash-lite": 900_000,
+}
+OUTPUT_RESERVE_TOKENS = 2048  # cadangan agar prompt + artikel tidak mepet batas konteks
+CHUNK_MAX_TOKENS = 400_000
+
+def article_budget(model_name: str, codebook_text: str) -> int:
+    # Sisa konteks untuk artikel: batas model - (rules + codebook + output rules) - cadangan.
+    prefix = approx_tokens(PROMPT_RULES) + approx_tokens(codebook_text) + approx_tokens(TASK_TPL)
+    return MODEL_MAX_INPUT_TOKENS.get(model_name, 900_000) - prefix - OUTPUT_RESERVE_TOKENS
+_SECTION_SPLIT_RE = re.compile(r"\n(?=Section|Chapter|\d+\.\s)")
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def _count_tokens(model_name: str, article_hash: str, _article_text: str) -> int:
+    return get_model(model_name).count_tokens(_article_text).total_tokens
+
+def article_tokens(model_name: str, article_text: str, budget: int) -> int:
+    # <= 1 token per karakter: teks yang lebih pendek dari budget tidak perlu dihitung lewat API.
+    if len(article_text) <= budget or not configure_genai():
+        return approx_tokens(article_text)
+    try:
+        return _count_tokens(model_name, text_hash(article_text), article_text)
+    except Exception:
+        return approx_tokens(article_text)
+
+def split_article(article_text: str, n_tokens: int) -> List[str]:
+    max_chars = max(1, int(len(article_text) * CHUNK_MAX_TOKENS / max(1, n_tokens)))
+    parts: List[str] = []
+    current = ""
+    for section in _SECTION_SPLIT_RE.split(article_text):
+        while len(section) > max_chars:  # section tunggal terlalu besar -> potong keras
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(section[:max_chars])
+            section = section[max_chars:]
+        if current and len(current) + len(section) + 1 > max_chars:
+            parts.append(current)
+            current = ""
+        current = f"{current}\n{section}" if current else section
+    if current:
+        parts.append(current)
+    return parts
+
+def pack_batches(documents: List[Tuple[str, str]], budget: int) -> List[List[Tuple[str, str]]]:
+    batches: List[List[Tuple[str, str]]] = []
+    current: List[Tuple[str, str]] = []
+    used = 0
+    for doc in documents:
+        n = approx_tokens(doc[1])
+        if current and used + n > budget:
+            batches.append(current)
+            current, used = [], 0
+        current.append(doc)
+        used += n
+    if current:
+        batches.append(current)
+    return batches
+
+def generate_coding_drafts_batch(
+    documents: List[Tuple[str, str]],
+    codebook_text: str,
+    model_name: str,
+    force_refresh: bool = False
+) -> Optional[Tuple[List[Tuple[int, str, List[Dict[str, Any]]]], str]]:
+    """
+    Kodekan beberapa artikel (doc_name, text) dalam satu request per batch,
+    sehingga codebook hanya dikirim sekali untuk N artikel.
+    Batch dibagi otomatis agar tiap request <= BATCH_MAX_INPUT_TOKENS (estimasi)
+    dan dijalankan paralel (maks. MAX_CONCURRENCY request sekaligus).
+    force_refresh=True melewati cache exact (hasil baru tetap disimpan ke cache).
+    Return: ([(posisi di documents, doc_name, rows), ...], used_model) atau None.
+    Posisi (bukan nama) mengikat hasil ke dokumen masukan: nama file bisa kembar.
+    """
+    # Dokumen yang sudah pernah dikodekan (model + codebook + teks sama) diambil dari cache exact;
+    # hanya sisanya yang dikirim. Entri dipakai bersama dengan jalur satu artikel.
+    codebook_hash = codebook_digest(codebook_text)
+    keys = [cache_key(model_name, codebook_hash, text) for _, text in documents]
+    hits: Dict[int, Tuple[List[Dict[str, Any]], str]] = {}
+    for i, key in enumerate(keys):
+        cached = None if force_refresh else cache_get(key)
+        if cached:
+            hits[i] = cached
+    pending_idx = [i for i in range(len(documents)) if i not in hits]
+    pending = [documents[i] for i in pending_idx]
+    if hits:
+        st.caption(f"⚡ {len(hits)} dari {len(documents)} dokumen diambil dari cache lokal (tanpa panggilan API).")
+    if pending and not configure_genai():
+        return None
+
+    budget = BATCH_MAX_INPUT_TOKENS - approx_tokens(codebook_text) - approx_tokens(PROMPT_RULES) - approx_tokens(BATCH_TASK_TPL)
+    batches = pack_batches(pending, budget)
+
+    def _code_batch(batch: List[Tuple[str, str]]) -> Optional[Tuple[Dict[str, Any], str]]:
+        articles = "".join(f"\n\n===DOC {i}===\n{text}" for i, (_, text) in enumerate(batch, start=1))
+        task_prompt = BATCH_TASK_TPL.format_map({"articles": articles})
+        return _generate_json(codebook_text, task_prompt, model_name, "documents")
+
+    # Batch dikirim paralel (I/O-bound); max_workers = batas konkurensi ke provider.
+    # Worker diberi ScriptRunContext agar pesan st.* dari _generate_json tetap tampil.
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(MAX_CONCURRENCY, len(batches) or 1)),
+        initializer=add_script_run_ctx,
+        initargs=(None, get_script_run_ctx()),
+    ) as pool:
+        futures = {pool.submit(_code_batch, batch): i for i, batch in enumerate(batches)}
+        results: List[Optional[Tuple[Dict[str, Any], str]]] = [None] * len(batches)
+        progress = st.progress(0.0, text=f"0/{len(batches)} batch selesai") if len(batches) > 1 else None
+        # Progres diperbarui dari thread utama saat tiap batch selesai (urutan selesai bebas).
+        for done, fut in enumerate(as_completed(futures), start=1):
+            results[futures[fut]] = fut.result()
+            if progress is not None:
+                progress.progress(done / len(batches), text=f"{done}/{len(batches)} batch selesai")
+        if progress is not None:
+            progress.empty()
+
+    fresh: Dict[int, List[Dict[str, Any]]] = {}
+    used_model = next(iter(hits.values()))[1] if hits else model_name
+    pos = iter(pending_idx)  # pack_batches menjaga urutan -> posisi dokumen asal
+    for batch, result in zip(batches, results):
+        batch_idx = [next(pos) for _ in batch]
+        if result is None:
+            st.warning(f"Batch berisi {len(batch)} dokumen gagal dikodekan; batch lain tetap diproses.")
+            continue
+        data, used_model = result
+        by_id = {re.sub(r"\D", "", doc["doc_id"]): doc["rows"] for doc in data["documents"]}
+        for i, (name, text) in enumerate(batch, start=1):
+            rows = by_id.get(str(i))
+            if rows is None:
+                st.warning(f"AI tidak mengembalikan baris untuk dokumen **{name}**.")
+                continue
+            fresh[batch_idx[i - 1]] = rows
+            if rows:
+                cache_set(keys[batch_idx[i - 1]], rows, used_model)
+
+    # Urutan keluaran = urutan dokumen masukan (cache hit & hasil baru digabung)
+    coded: List[Tuple[int, str, List[Dict[str, Any]]]] = []
+    for i, (name, _) in enumerate(documents):
+        if i in hits:
+            coded.append((i, name, hits[i][0]))
+        elif i in fresh:
+            coded.append((i, name, fresh[i]))
+
+    return (coded, used_model) if coded else None
+
+def article_key(text: str) -> str:
+    return text_hash(text)[:12]
+
+def prepare_rows(rows: List[Dict[str, Any]], article_id: str, doc_id: str = "") -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    for r in rows:
+        # Semua baris di sini sudah lolos VALIDATORS/ROW_VALIDATOR -> jalur trusted (tanpa cek enum ulang).
+        # apply_qc_rules tetap membentuk salinan baru sehingga input tidak termutasi.
+        row = apply_qc_rules({**r, "doc_id": doc_id, "article_id": article_id}, trusted=True)
+        row["_uid"] = uuid.uuid4().hex  # identitas baris antrean untuk key widget form (di luar COLUMNS)
+        out.append(row)
+    return out
+
+def register_article(text: str) -> str:
+    # Simpan teks artikel sekali di sesi; baris cukup membawa article_id-nya.
+    article_id = article_key(text)
+    st.session_state.articles.setdefault(article_id, text)
+    return article_id
+
+def prepare_rows_batch(items: List[Tuple[List[Dict[str, Any]], str, str]]) -> List[Dict[str, Any]]:
+    """
+    Padanan prepare_rows untuk banyak dokumen sekaligus: items = [(rows, article_id, doc_id), ...].
+    QC dijalankan satu kali secara vektor (apply_qc_rules_df) atas seluruh baris batch.
+    """
+    flat = [{**r, "doc_id": doc_id, "article_id": article_id} for rows, article_id, doc_id in items for r in rows]
+    if not flat:
+        return []
+    out = apply_qc_rules_df(pd.DataFrame(flat)).to_dict(orient="records")
+    for row in out:
+        row["_uid"] = uuid.uuid4().hex
+    return out
+
 # =========================
 # Session State
 # =========================
+if "stream_job" not in st.session_state:
+    st.session_state.stream_job = None
+    st.session_state.stream_taken = 0  # kursor per sesi atas stream_job["rows"] (job bisa dibagi)
 if "coding_queue" not in st.session_state:
     st.session_state.coding_queue = []
 if "coding_result" not in st.session_state:
     st.session_state.coding_result = None
-if "coded_data" not in st.session_state:
-    st.session_state.coded_data = pd.DataFrame(columns=COLUMNS)
+if "articles" not in st.session_state:
+    # article_id -> teks artikel; satu salinan per artikel, bukan per baris
+    st.session_state.articles = {}
+if "coded_rows" not in st.session_state:
+    # List of dict (urutan COLUMNS); DataFrame hanya dibangun saat tampil/ekspor.
+    st.session_state.coded_rows = []
+if "rows_version" not in st.session_state:
+    # rows_version naik di setiap perubahan coded_rows; session_uid:rows_version = fingerprint cache tampilan/ekspor
+    st.session_state.rows_version = 0
+    st.session_state.session_uid = uuid.uuid4().hex
 
 # =========================
 # UI
@@ -429,12 +1460,19 @@ left, right = st.columns([2,1])
 
 with right:
     st.subheader("⚙️ Konfigurasi")
-    MODEL_OPTIONS = ["gemini-2.5-flash", "gemini-2.5-pro", "gemini-2.5-flash-lite"]
+    MODEL_OPTIONS = ["gemini-2.5-flash", "gemini-2.5-pro", "gemini-2.5-flash-lite", AUTO_MODEL]
     model_choice = st.radio(
         "Pilih Model Gemini:",
         options=MODEL_OPTIONS,
+        format_func=lambda m: "Otomatis (routing Flash/Pro per artikel)" if m == AUTO_MODEL else m,
         index=0,  # default: 2.5 Flash (efisien & kuota biasanya lebih longgar)
-        help="2.5 Pro = akurasi/penalaran tinggi; 2.5 Flash = efisien; Flash-Lite = paling hemat biaya."
+        help="2.5 Pro = akurasi/penalaran tinggi; 2.5 Flash = efisien; Flash-Lite = paling hemat biaya. "
+             "Otomatis = artikel pendek/jelas ke Flash, artikel panjang/ambigu ke Pro."
+    )
+    force_refresh = st.checkbox(
+        "Paksa jalankan ulang (abaikan cache)",
+        value=False,
+        help="Lewati cache lokal & semantik untuk artikel/berkas ini; hasil baru tetap disimpan ke cache."
     )
 
 with left:
@@ -444,164 +1482,396 @@ with left:
         height=500,
         placeholder="Tempel full text, sertakan penanda halaman/fig jika ada."
     )
+    uploaded_files = st.file_uploader(
+        "Atau unggah beberapa artikel (.txt/.md) untuk pengodean batch:",
+        type=["txt", "md"],
+        accept_multiple_files=True,
+        help="Bila ada file terunggah, semua file dikodekan dalam batch (codebook dikirim sekali per batch)."
+    )
     if st.button("Mulai Pengodean Otomatis", type="primary", use_container_width=True):
-        if not article_input:
-            st.warning("Masukkan teks artikel terlebih dahulu.")
-        else:
-            with st.spinner("AI sedang membaca & mengodekan..."):
-                result = generate_coding_draft(article_text=article_input, codebook_text=CODEBOOK_TEXT, model_name=model_choice)
+        if uploaded_files:
+            documents = [(f.name, f.getvalue().decode("utf-8", errors="replace").strip()) for f in uploaded_files]
+            documents = [d for d in documents if d[1]]
+            batch_model = model_choice
+            if model_choice == AUTO_MODEL:
+                # Satu request memuat banyak artikel -> Pro bila ada satu saja kasus sulit.
+                routed = {route_model(text) for _, text in documents}
+                batch_model = "gemini-2.5-pro" if "gemini-2.5-pro" in routed else "gemini-2.5-flash"
+            # File yang melebihi sisa konteks model dipecah per section; baris tiap bagian
+            # dikembalikan ke dokumen asalnya (doc_id & article_id = file utuh).
+            budget = article_budget(batch_model, CODEBOOK_TEXT)
+            origin: List[Tuple[int, str, str]] = []  # sejajar parts_docs: (posisi file, nama file, teks utuh)
+            parts_docs: List[Tuple[str, str]] = []
+            for doc_i, (name, text) in enumerate(documents):
+                n_tokens = approx_tokens(text)
+                parts = split_article(text, n_tokens) if n_tokens > budget else [text]
+                for i, part in enumerate(parts, start=1):
+                    part_name = f"{name} [bagian {i}/{len(parts)}]" if len(parts) > 1 else name
+                    origin.append((doc_i, name, text))
+                    parts_docs.append((part_name, part))
+            if len(parts_docs) > len(documents):
+                st.info(f"Sebagian file melebihi ±{budget:,} token; dikodekan dalam {len(parts_docs)} bagian lalu digabung per file.")
+            with st.spinner(f"AI sedang membaca & mengodekan {len(documents)} dokumen..."):
+                result = generate_coding_drafts_batch(documents=parts_docs, codebook_text=CODEBOOK_TEXT, model_name=batch_model, force_refresh=force_refresh)
                 if result:
-                    rows, used_model = result
-                    q: List[Dict[str, Any]] = []
-                    for r in rows:
-                        r["original_text"] = article_input
-                        r = normalise_row(r)
-                        r = apply_qc_rules(r)  # QC ketat (isi NA, anchors/evidence konsisten)
-                        q.append(r)
-                    st.session_state.coding_queue = q
-                    st.session_state.coding_result = st.session_state.coding_queue.pop(0)
-                    st.success(f"AI menghasilkan {len(rows)} baris. Verifikasi baris pertama di bawah.")
-                    st.caption(f"Model aktif: {used_model}")
+                    coded, used_model = result
+                    q = prepare_rows_batch([(rows, register_article(origin[j][2]), origin[j][1]) for j, _, rows in coded])
+                    if q:
+                        st.session_state.stream_job = None
+                        st.session_state.coding_queue = q
+                        st.session_state.coding_result = st.session_state.coding_queue.pop(0)
+                        st.success(f"AI menghasilkan {len(q)} baris dari {len({origin[j][0] for j, _, _ in coded})} dokumen. Verifikasi baris pertama di bawah.")
+                        st.caption(f"Model aktif: {used_model}")
+                    else:
+                        st.error("Tidak ada baris yang dihasilkan.")
                 else:
                     st.error("Tidak ada baris yang dihasilkan / JSON tidak valid.")
+        elif not article_input:
+            st.warning("Masukkan teks artikel terlebih dahulu.")
+        else:
+            article_model = route_model(article_input) if model_choice == AUTO_MODEL else model_choice
+            budget = article_budget(article_model, CODEBOOK_TEXT)
+            n_tokens = article_tokens(article_model, article_input, budget)
+            if n_tokens > budget:
+                parts = split_article(article_input, n_tokens)
+                st.info(f"Artikel ±{n_tokens:,} token (> sisa konteks {budget:,}); dikodekan dalam {len(parts)} bagian lalu digabung.")
+                with st.spinner(f"AI sedang membaca & mengodekan {len(parts)} bagian artikel..."):
+                    result = generate_coding_drafts_batch(
+                        documents=[(f"bagian {i}/{len(parts)}", part) for i, part in enumerate(parts, start=1)],
+                        codebook_text=CODEBOOK_TEXT, model_name=article_model, force_refresh=force_refresh
+                    )
+                    article_id = register_article(article_input)
+                    q = prepare_rows_batch([(rows, article_id, "") for _, _, rows in (result[0] if result else [])])
+                    if q:
+                        st.session_state.stream_job = None
+                        st.session_state.coding_queue = q
+                        st.session_state.coding_result = st.session_state.coding_queue.pop(0)
+                        st.success(f"AI menghasilkan {len(q)} baris dari {len(parts)} bagian. Verifikasi baris pertama di bawah.")
+                        st.caption(f"Model aktif: {result[1]}")
+                    else:
+                        st.error("Tidak ada baris yang dihasilkan / JSON tidak valid.")
+            else:
+                with st.spinner("AI sedang membaca & mengodekan..."):
+                    job = new_stream_job(register_article(article_input))
+                    result = generate_coding_draft(
+                        article_text=article_input, codebook_text=CODEBOOK_TEXT, model_name=article_model, stream_job=job,
+                        force_refresh=force_refresh
+                    )
+                    if result and (result[0] or not job["finished"].is_set()):
+                        rows, used_model = result
+                        st.session_state.stream_job = job
+                        st.session_state.stream_taken = 0
+                        st.session_state.coding_queue = prepare_rows(rows, job["article_id"])
+                        st.session_state.coding_result = (
+                            st.session_state.coding_queue.pop(0) if st.session_state.coding_queue else None
+                        )
+                        st.success(f"AI menghasilkan {len(rows)} baris{'' if job['finished'].is_set() else ' (sisa baris masih di-stream)'}. Verifikasi baris pertama di bawah.")
+                        st.caption(f"Model aktif: {used_model}")
+                    else:
+                        st.error("Tidak ada baris yang dihasilkan / JSON tidak valid.")
 
 st.markdown("---")
 
 # =========================
 # Verifikasi & Edit
 # =========================
-if st.session_state.coding_result:
-    st.header("✅ Verifikasi & Edit Hasil (Per Baris)")
-    r = st.session_state.coding_result
-
-    with st.form("verification_form"):
-        st.subheader("Screening & Scope")
-        inc_opts = ENUMS["inclusion_I1"]
-        scope_opts = ENUMS["scope_decision"]
-        ua_opts = ENUMS["unit_of_analysis"]
-
-        rrn = st.text_input("RRN (opsional)", value=r.get("rrn",""))
-        inclusion_I1 = st.selectbox("I1 Concept focus (village/CBT unit)", inc_opts, index=inc_opts.index(r.get("inclusion_I1","NA")))
-        inclusion_I2 = st.selectbox("I2 Scholarly/credible", inc_opts, index=inc_opts.index(r.get("inclusion_I2","NA")))
-        inclusion_I3 = st.selectbox("I3 Conceptual utility", inc_opts, index=inc_opts.index(r.get("inclusion_I3","NA")))
-        exclusion_E1 = st.selectbox("E1 Scale too broad/narrow", ENUMS["exclusion_E1"], index=ENUMS["exclusion_E1"].index(r.get("exclusion_E1","No")))
-        exclusion_E2 = st.selectbox("E2 Non-scholarly/insubstantial", ENUMS["exclusion_E2"], index=ENUMS["exclusion_E2"].index(r.get("exclusion_E2","No")))
-        unit_of_analysis = st.selectbox("Unit of analysis", ua_opts, index=ua_opts.index(r.get("unit_of_analysis","Village/community")))
-        scope_decision = st.selectbox("Scope decision", scope_opts, index=scope_opts.index(r.get("scope_decision","Include")))
-        scope_justification = st.text_area("Scope justification (ringkas + anchor)", value=r.get("scope_justification",""), height=80)
-
-        st.subheader("Definitions & Typology")
-        def_opts = ENUMS["explicit_definition"]; typ_opts = ENUMS["typology_proposed"]
-        explicit_definition = st.selectbox("Explicit definition", def_opts, index=def_opts.index(r.get("explicit_definition","No")))
-        verbatim_definition = st.text_area("Verbatim definition (quote + page/section)", value=r.get("verbatim_definition",""), height=90)
-        typology_proposed = st.selectbox("Typology proposed", typ_opts, index=typ_opts.index(r.get("typology_proposed","No")))
-        typology_details = st.text_area("Typology details (classes + rules)", value=r.get("typology_details",""), height=90)
-
-        st.subheader("Axes + Anchors")
-        axis_A = st.selectbox("Axis A", ENUMS["axis_A"], index=ENUMS["axis_A"].index(r.get("axis_A","NA")))
-        axis_A_anchor = st.text_input("Axis A anchor", value=r.get("axis_A_anchor",""))
-        axis_B = st.selectbox("Axis B", ENUMS["axis_B"], index=ENUMS["axis_B"].index(r.get("axis_B","NA")))
-        axis_B_anchor = st.text_input("Axis B anchor", value=r.get("axis_B_anchor",""))
-        axis_C = st.selectbox("Axis C", ENUMS["axis_C"], index=ENUMS["axis_C"].index(r.get("axis_C","NA")))
-        axis_C_anchor = st.text_input("Axis C anchor", value=r.get("axis_C_anchor",""))
-
-        st.subheader("Purpose & Findings")
-        purpose_tokens = st.text_input("Purpose tokens (DEV|LIV|SUS ...)", value=r.get("purpose_tokens",""))
-        key_findings = st.text_area("Key arguments/findings (2–4 lines)", value=r.get("key_findings",""), height=90)
-
-        st.subheader("Outcomes + Evidence")
-        lvl_opts = ENUMS["participation_level"]; eq_q = ENUMS["evidence_quality"]; yn_opts = ENUMS["inferred"]
-        participation_level = st.selectbox("Participation level", lvl_opts, index=lvl_opts.index(r.get("participation_level","NA")))
-        participation_evidence = st.text_area("Participation evidence (verbatim + anchor)", value=r.get("participation_evidence",""), height=90)
-        equity_level = st.selectbox("Equity level", lvl_opts, index=lvl_opts.index(r.get("equity_level","NA")))
-        equity_evidence = st.text_area("Equity evidence (verbatim + anchor) — WAJIB bila level≠NA", value=r.get("equity_evidence",""), height=90)
-        env_level = st.selectbox("Environmental level", lvl_opts, index=lvl_opts.index(r.get("env_level","NA")))
-        env_evidence = st.text_area("Environmental evidence (verbatim + anchor) — WAJIB bila level≠NA", value=r.get("env_evidence",""), height=90)
-
-        st.subheader("Tags & QC")
-        equity_tags = st.text_input("Equity tags", value=r.get("equity_tags",""))
-        engagement_tags = st.text_input("Engagement tags", value=r.get("engagement_tags",""))
-        evidence_quality = st.selectbox("Evidence quality", eq_q, index=eq_q.index(r.get("evidence_quality","Moderate")))
-        inferred = st.selectbox("Inferred?", yn_opts, index=yn_opts.index(r.get("inferred","No")))
-        notes = st.text_area("Notes (≤2 lines)", value=r.get("notes",""), height=70)
-        split_case = st.selectbox("Split-case row?", ENUMS["split_case"], index=ENUMS["split_case"].index(r.get("split_case","No")))
-
-        submitted = st.form_submit_button("Setuju & Simpan ke Sesi", use_container_width=True)
-        if submitted:
-            row: Dict[str, Any] = {
-                # Screening & Scope
-                "rrn": rrn,
-                "inclusion_I1": inclusion_I1, "inclusion_I2": inclusion_I2, "inclusion_I3": inclusion_I3,
-                "exclusion_E1": exclusion_E1, "exclusion_E2": exclusion_E2,
-                "scope_decision": scope_decision, "scope_justification": scope_justification,
-                "literature_type": r.get("literature_type",""), "geographic_focus": r.get("geographic_focus",""),
-                "unit_of_analysis": unit_of_analysis,
-                # Core extraction
-                "explicit_definition": explicit_definition, "verbatim_definition": verbatim_definition,
-                "typology_proposed": typology_proposed, "typology_details": typology_details,
-                "axis_A": axis_A, "axis_B": axis_B, "axis_C": axis_C,
-                "axis_A_anchor": axis_A_anchor, "axis_B_anchor": axis_B_anchor, "axis_C_anchor": axis_C_anchor,
-                "purpose_tokens": purpose_tokens, "key_findings": key_findings,
-                # Outcomes
-                "participation_level": participation_level, "participation_evidence": participation_evidence,
-                "equity_level": equity_level, "equity_evidence": equity_evidence,
-                "env_level": env_level, "env_evidence": env_evidence,
-                # Tags & QC
-                "equity_tags": equity_tags, "engagement_tags": engagement_tags,
-                "evidence_quality": evidence_quality, "inferred": inferred, "notes": notes, "split_case": split_case,
-                # Original
-                "original_text": r.get("original_text","")
-            }
-            row = normalise_row(row)
-            row = apply_qc_rules(row)
+# Kolom yang diedit di form per baris (sama dengan key widget tanpa prefix)
+VERIFY_FIELDS: List[str] = [
+    "rrn",
+    "inclusion_I1",
+    "inclusion_I2",
+    "inclusion_I3",
+    "exclusion_E1",
+    "exclusion_E2",
+    "unit_of_analysis",
+    "scope_decision",
+    "scope_justification",
+    "explicit_definition",
+    "verbatim_definition",
+    "typology_proposed",
+    "typology_details",
+    "axis_A",
+    "axis_A_anchor",
+    "axis_B",
+    "axis_B_anchor",
+    "axis_C",
+    "axis_C_anchor",
+    "purpose_tokens",
+    "key_findings",
+    "participation_level",
+    "participation_evidence",
+    "equity_level",
+    "equity_evidence",
+    "env_level",
+    "env_evidence",
+    "equity_tags",
+    "engagement_tags",
+    "evidence_quality",
+    "inferred",
+    "notes",
+    "split_case",
+]
 
-            row_df = pd.DataFrame([{col: row.get(col, "") for col in COLUMNS}])
-            st.session_state.coded_data = pd.concat([st.session_state.coded_data, row_df], ignore_index=True)
+def save_verified_row(vf: str) -> None:
+    """
+    Callback submit form verifikasi: jalan sebelum rerun berikutnya, sehingga simpan baris +
+    tampil baris antrean berikutnya cukup satu rerun fragment (tanpa st.rerun() tambahan).
+    Nilai widget dibaca dari session_state lewat key f"{vf}{kolom}".
+    """
+    row: Dict[str, Any] = {
+        **st.session_state.coding_result,  # kolom di luar form (literature_type, geographic_focus, doc_id, article_id)
+        **{c: st.session_state.pop(f"{vf}{c}") for c in VERIFY_FIELDS},  # pop: state widget baris lama tidak menumpuk
+    }
+    # Baris sudah lewat prepare_rows & enum berasal dari selectbox ENUMS -> jalur trusted (hanya bentuk kolom)
+    st.session_state.coded_rows.append(apply_qc_rules(row, trusted=True))
+    st.session_state.rows_version += 1
+    # Elemen (toast/balon) tidak dipanggil dari callback: di dalam fragment itu menimpa bagian atas app.
+    # Cukup tandai di session_state; body fragment yang menampilkannya.
+    st.session_state.row_saved = True
+    if st.session_state.coding_queue:
+        st.session_state.coding_result = st.session_state.coding_queue.pop(0)
+    else:
+        st.session_state.coding_result = None
+        job = st.session_state.stream_job
+        if job is None or (job["finished"].is_set() and st.session_state.stream_taken >= len(job["rows"])):
+            st.session_state.queue_done = True
+
+@st.fragment
+def verification_section() -> None:
+    """
+    Tarik baris stream + form verifikasi + data terkode sebagai satu fragment: simpan satu baris
+    (atau "Muat baris baru", ganti halaman) hanya menjalankan ulang bagian ini, bukan seluruh app,
+    dan tabel/unduhan di bawah selalu memuat baris yang baru disimpan.
+    """
+    if st.session_state.pop("row_saved", False):
+        st.toast("Baris tersimpan ke sesi.")
+    if st.session_state.pop("queue_done", False):
+        st.balloons()
+
+    # Streaming: tarik baris baru dari thread latar ke antrean
+    job = st.session_state.stream_job
+    if job is not None:
+        finished = job["finished"].is_set()  # dibaca sebelum slicing agar baris terakhir tidak terlewat
+        fresh = job["rows"][st.session_state.stream_taken:]
+        st.session_state.stream_taken += len(fresh)
+        if fresh and (fresh[0]["article_id"], fresh[0]["doc_id"]) != (job["article_id"], job["doc_id"]):
+            # Job dibagi dari sesi lain (dedup_call): baris latar dibentuk dengan id leader -> pakai id sesi ini
+            fresh = [{**r, "article_id": job["article_id"], "doc_id": job["doc_id"]} for r in fresh]
+        st.session_state.coding_queue.extend(fresh)  # sudah di-QC oleh thread stream
+        if st.session_state.coding_result is None and st.session_state.coding_queue:
+            st.session_state.coding_result = st.session_state.coding_queue.pop(0)
+        if finished:
+            if job["errors"]:
+                st.warning(f"Stream AI berhenti sebelum selesai: {job['errors'][-1]}")
+            st.session_state.stream_job = None
+        else:
+            s1, s2 = st.columns([3,1])
+            s1.info("⏳ AI masih menghasilkan baris berikutnya. Klik **Muat baris baru** (atau simpan baris) untuk menarik baris yang sudah selesai ke antrean.")
+            s2.button("🔄 Muat baris baru", use_container_width=True)
+            st.markdown("---")
+
+    # Mode tabel: semua baris antrean diverifikasi dalam satu data_editor & satu submit (satu rerun untuk N baris)
+    batch_mode = bool(st.session_state.coding_result and st.session_state.coding_queue) and st.checkbox(
+        f"Edit semua baris antrean dalam satu tabel ({len(st.session_state.coding_queue) + 1} baris)",
+        value=False,
+        help="Berguna untuk split-case dengan banyak baris; QC ketat tetap dijalankan per baris saat disimpan."
+    )
 
-            st.success("Baris tersimpan ke sesi.")
-            if st.session_state.coding_queue:
-                st.session_state.coding_result = st.session_state.coding_queue.pop(0)
-                st.rerun()
-            else:
+    if batch_mode:
+        st.header("✅ Verifikasi & Edit Hasil (Semua Baris Antrean)")
+        with st.form("verification_table_form"):
+            edited = st.data_editor(
+                pd.DataFrame([st.session_state.coding_result] + st.session_state.coding_queue, columns=COLUMNS),
+                num_rows="fixed",
+                use_container_width=True,
+                column_config={
+                    **{c: st.column_config.SelectboxColumn(c, options=v, required=True) for c, v in ENUMS.items()},
+                    "doc_id": st.column_config.TextColumn("doc_id", disabled=True),
+                    "article_id": st.column_config.TextColumn("article_id", disabled=True),
+                },
+            )
+            if st.form_submit_button("Setujui & Simpan Semua ke Sesi", use_container_width=True):
+                st.session_state.coded_rows.extend(apply_qc_rules_df(edited).to_dict(orient="records"))
+                st.session_state.rows_version += 1
+                st.session_state.coding_queue = []
                 st.session_state.coding_result = None
-                st.balloons()
-                st.rerun()
+                if st.session_state.stream_job is None:
+                    st.session_state.queue_done = True
+                st.rerun(scope="fragment")  # form sudah dirender dengan antrean lama; tabel data ikut diperbarui
+
+    elif st.session_state.coding_result:
+        st.header("✅ Verifikasi & Edit Hasil (Per Baris)")
+        r = st.session_state.coding_result
+        if r.get("doc_id"):
+            st.caption(f"Dokumen: **{r['doc_id']}** · sisa antrean: {len(st.session_state.coding_queue)} baris")
+
+        vf = f"vf{r.get('_uid', '')}_"  # prefix key per baris antrean: tiap baris mendapat widget (dan nilai awal) sendiri
+        with st.form("verification_form"):
+            st.subheader("Screening & Scope")
+            inc_opts = ENUMS["inclusion_I1"]
+            scope_opts = ENUMS["scope_decision"]
+            ua_opts = ENUMS["unit_of_analysis"]
+
+            st.text_input("RRN (opsional)", value=r.get("rrn",""), key=f"{vf}rrn")
+            st.selectbox("I1 Concept focus (village/CBT unit)", inc_opts, index=enum_index("inclusion_I1", r.get("inclusion_I1"), "NA"), key=f"{vf}inclusion_I1")
+            st.selectbox("I2 Scholarly/credible", inc_opts, index=enum_index("inclusion_I2", r.get("inclusion_I2"), "NA"), key=f"{vf}inclusion_I2")
+            st.selectbox("I3 Conceptual utility", inc_opts, index=enum_index("inclusion_I3", r.get("inclusion_I3"), "NA"), key=f"{vf}inclusion_I3")
+            st.selectbox("E1 Scale too broad/narrow", ENUMS["exclusion_E1"], index=enum_index("exclusion_E1", r.get("exclusion_E1"), "No"), key=f"{vf}exclusion_E1")
+            st.selectbox("E2 Non-scholarly/insubstantial", ENUMS["exclusion_E2"], index=enum_index("exclusion_E2", r.get("exclusion_E2"), "No"), key=f"{vf}exclusion_E2")
+            st.selectbox("Unit of analysis", ua_opts, index=enum_index("unit_of_analysis", r.get("unit_of_analysis"), "Village/community"), key=f"{vf}unit_of_analysis")
+            st.selectbox("Scope decision", scope_opts, index=enum_index("scope_decision", r.get("scope_decision"), "Include"), key=f"{vf}scope_decision")
+            st.text_area("Scope justification (ringkas + anchor)", value=r.get("scope_justification",""), height=80, key=f"{vf}scope_justification")
+
+            st.subheader("Definitions & Typology")
+            def_opts = ENUMS["explicit_definition"]; typ_opts = ENUMS["typology_proposed"]
+            st.selectbox("Explicit definition", def_opts, index=enum_index("explicit_definition", r.get("explicit_definition"), "No"), key=f"{vf}explicit_definition")
+            st.text_area("Verbatim definition (quote + page/section)", value=r.get("verbatim_definition",""), height=90, key=f"{vf}verbatim_definition")
+            st.selectbox("Typology proposed", typ_opts, index=enum_index("typology_proposed", r.get("typology_proposed"), "No"), key=f"{vf}typology_proposed")
+            st.text_area("Typology details (classes + rules)", value=r.get("typology_details",""), height=90, key=f"{vf}typology_details")
+
+            st.subheader("Axes + Anchors")
+            st.selectbox("Axis A", ENUMS["axis_A"], index=enum_index("axis_A", r.get("axis_A"), "NA"), key=f"{vf}axis_A")
+            st.text_input("Axis A anchor", value=r.get("axis_A_anchor",""), key=f"{vf}axis_A_anchor")
+            st.selectbox("Axis B", ENUMS["axis_B"], index=enum_index("axis_B", r.get("axis_B"), "NA"), key=f"{vf}axis_B")
+            st.text_input("Axis B anchor", value=r.get("axis_B_anchor",""), key=f"{vf}axis_B_anchor")
+            st.selectbox("Axis C", ENUMS["axis_C"], index=enum_index("axis_C", r.get("axis_C"), "NA"), key=f"{vf}axis_C")
+            st.text_input("Axis C anchor", value=r.get("axis_C_anchor",""), key=f"{vf}axis_C_anchor")
+
+            st.subheader("Purpose & Findings")
+            st.text_input("Purpose tokens (DEV|LIV|SUS ...)", value=r.get("purpose_tokens",""), key=f"{vf}purpose_tokens")
+            st.text_area("Key arguments/findings (2–4 lines)", value=r.get("key_findings",""), height=90, key=f"{vf}key_findings")
+
+            st.subheader("Outcomes + Evidence")
+            lvl_opts = ENUMS["participation_level"]; eq_q = ENUMS["evidence_quality"]; yn_opts = ENUMS["inferred"]
+            st.selectbox("Participation level", lvl_opts, index=enum_index("participation_level", r.get("participation_level"), "NA"), key=f"{vf}participation_level")
+            st.text_area("Participation evidence (verbatim + anchor)", value=r.get("participation_evidence",""), height=90, key=f"{vf}participation_evidence")
+            st.selectbox("Equity level", lvl_opts, index=enum_index("equity_level", r.get("equity_level"), "NA"), key=f"{vf}equity_level")
+            st.text_area("Equity evidence (verbatim + anchor) — WAJIB bila level≠NA", value=r.get("equity_evidence",""), height=90, key=f"{vf}equity_evidence")
+            st.selectbox("Environmental level", lvl_opts, index=enum_index("env_level", r.get("env_level"), "NA"), key=f"{vf}env_level")
+            st.text_area("Environmental evidence (verbatim + anchor) — WAJIB bila level≠NA", value=r.get("env_evidence",""), height=90, key=f"{vf}env_evidence")
+
+            st.subheader("Tags & QC")
+            st.text_input("Equity tags", value=r.get("equity_tags",""), key=f"{vf}equity_tags")
+            st.text_input("Engagement tags", value=r.get("engagement_tags",""), key=f"{vf}engagement_tags")
+            st.selectbox("Evidence quality", eq_q, index=enum_index("evidence_quality", r.get("evidence_quality"), "Moderate"), key=f"{vf}evidence_quality")
+            st.selectbox("Inferred?", yn_opts, index=enum_index("inferred", r.get("inferred"), "No"), key=f"{vf}inferred")
+            st.text_area("Notes (≤2 lines)", value=r.get("notes",""), height=70, key=f"{vf}notes")
+            st.selectbox("Split-case row?", ENUMS["split_case"], index=enum_index("split_case", r.get("split_case"), "No"), key=f"{vf}split_case")
+
+            st.form_submit_button("Setuju & Simpan ke Sesi", use_container_width=True, on_click=save_verified_row, args=(vf,))
+
+    coded_data_section()
 
 # =========================
 # Data & Export (sanitasi anti-kosong)
 # =========================
 def sanitize_df_for_output(df: pd.DataFrame) -> pd.DataFrame:
     # Pastikan tidak ada NaN dan string kosong
-    out = df.copy()
-    out = out.fillna("NA")
-    # Ganti string kosong "" menjadi "NA" untuk seluruh kolom kecuali original_text
-    for col in out.columns:
-        if col == "original_text":
-            continue
-        out[col] = out[col].apply(lambda x: ("NA" if isinstance(x, str) and x.strip() == "" else x))
+    out = df.fillna("NA")  # fillna sudah mengembalikan salinan
+    # Ganti string kosong "" menjadi "NA" untuk seluruh kolom kecuali original_text (vektor, bukan apply per sel)
+    cols = [c for c in out.columns if c != "original_text"]
+    out[cols] = out[cols].replace(r"^\s*$", "NA", regex=True)
     return out
 
-if not st.session_state.coded_data.empty:
+PAGE_SIZE = 50
+
+def sanitize_row_for_output(row: Dict[str, Any], columns: List[str] = COLUMNS) -> Dict[str, Any]:
+    # Padanan sanitize_df_for_output per baris (tanpa DataFrame), untuk ekspor JSON langsung dari list
+    return {
+        col: ("NA" if val is None or (col != "original_text" and isinstance(val, str) and val.strip() == "") else val)
+        for col, val in ((c, row.get(c)) for c in columns)
+    }
+
+def rows_to_df(rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    # Sanitasi dulu (fillna "NA" tidak valid untuk semua kategori), lalu enum -> category.
+    return sanitize_df_for_output(pd.DataFrame(rows, columns=COLUMNS)).astype(CATEGORICAL_DTYPES)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def page_df(fingerprint: str, start: int, _rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    # Frame halaman tampilan hanya dibangun ulang bila data (rows_version) atau halaman berubah.
+    df = rows_to_df(_rows[start:start + PAGE_SIZE])
+    df.index = pd.RangeIndex(start, start + len(df))
+    return df
+
+def encode_exports(
+    fingerprint: str, _rows: List[Dict[str, Any]], articles: Optional[Dict[str, str]] = None
+) -> Tuple[bytes, bytes, bytes]:
+    # Memo per sesi (session_state), di-key fingerprint (session_uid:rows_version): rerun tanpa perubahan
+    # data tidak menserialisasi ulang. Bukan st.cache_data: itu meng-unpickle salinan bytes ekspor di
+    # setiap hit dan menyimpan versi lama yang tak akan dipakai lagi di cache global.
+    memo = st.session_state.get("export_memo")
+    if memo is not None and memo[0] == fingerprint:
+        return memo[1], memo[2], memo[3]
+    # articles != None -> teks lengkap di-join kembali (kolom original_text) hanya untuk ekspor ini.
+    columns = COLUMNS
+    if articles is not None:
+        columns = COLUMNS + ["original_text"]
+        _rows = [{**r, "original_text": articles.get(r.get("article_id", ""), "")} for r in _rows]
+    # JSON langsung dari list baris via orjson; DataFrame hanya untuk CSV.
+    # CSV ditulis langsung sebagai bytes ke buffer (tanpa str perantara + .encode salinan kedua).
+    buf = io.BytesIO()
+    sanitize_df_for_output(pd.DataFrame(_rows, columns=columns)).to_csv(buf, index=False, encoding="utf-8")
+    csv_bytes = buf.getvalue()
+    json_bytes = orjson.dumps([sanitize_row_for_output(r, columns) for r in _rows], option=orjson.OPT_NON_STR_KEYS)
+    # CSV terkompresi gzip (stdlib) untuk unduhan besar (dengan original_text): ikut memo yang sama,
+    # jadi kompresi hanya dijalankan sekali per versi data. mtime=0 -> bytes deterministik.
+    csv_gz = gzip.compress(csv_bytes, compresslevel=6, mtime=0)
+    st.session_state.export_memo = (fingerprint, csv_bytes, json_bytes, csv_gz)
+    return csv_bytes, json_bytes, csv_gz
+
+def coded_data_section() -> None:
+    # Dirender di dalam fragment verification_section: ganti halaman / opsi unduhan / simpan baris
+    # tidak menjalankan ulang pengaturan & input artikel di atas.
+    if not st.session_state.coded_rows:
+        return
     st.markdown("---")
     st.header("🗂️ Data Terkode Sesi Ini")
 
-    display_df = sanitize_df_for_output(st.session_state.coded_data)
+    # Tampilkan per halaman: hanya PAGE_SIZE baris yang diserialisasi ke browser tiap rerun.
+    n_rows = len(st.session_state.coded_rows)
+    n_pages = (n_rows - 1) // PAGE_SIZE + 1
+    if n_pages > 1:
+        page = st.number_input(f"Halaman (1–{n_pages}, {PAGE_SIZE} baris/halaman)", min_value=1, max_value=n_pages, value=1, step=1)
+    else:
+        page = 1
+    start = (page - 1) * PAGE_SIZE
+    fingerprint = f"{st.session_state.session_uid}:{st.session_state.rows_version}"
+    display_df = page_df(fingerprint, start, st.session_state.coded_rows)
     st.dataframe(display_df, use_container_width=True)
+    st.caption(f"Baris {start + 1}–{start + len(display_df)} dari {n_rows}. Unduhan berisi seluruh baris.")
 
-    c1, c2, c3 = st.columns(3)
+    with_text = st.checkbox(
+        "Sertakan teks lengkap artikel (original_text) di unduhan",
+        value=False,
+        help="Baris hanya menyimpan article_id; teks artikel disimpan sekali per sesi dan di-join saat ekspor."
+    )
+    csv_bytes, json_bytes, csv_gz = encode_exports(
+        f"{fingerprint}:{int(with_text)}", st.session_state.coded_rows,
+        st.session_state.articles if with_text else None
+    )
+    c1, c2, c3, c4 = st.columns(4)
     with c1:
-        csv_bytes = display_df.to_csv(index=False).encode("utf-8")
         st.download_button("⬇️ Unduh CSV", data=csv_bytes, file_name="coded_data.csv", mime="text/csv", use_container_width=True)
     with c2:
-        json_bytes = display_df.to_json(orient="records", force_ascii=False).encode("utf-8")
         st.download_button("⬇️ Unduh JSON (records)", data=json_bytes, file_name="coded_data.json", mime="application/json", use_container_width=True)
     with c3:
+        st.download_button(
+            "⬇️ Unduh CSV.gz", data=csv_gz, file_name="coded_data.csv.gz", mime="application/gzip",
+            use_container_width=True, help=f"CSV terkompresi ({len(csv_gz) / 1024:.0f} KB vs {len(csv_bytes) / 1024:.0f} KB)."
+        )
+    with c4:
         if st.button("🧹 Bersihkan Data Sesi", use_container_width=True):
-            st.session_state.coded_data = pd.DataFrame(columns=COLUMNS)
+            st.session_state.coded_rows = []
+            st.session_state.articles = {}
+            st.session_state.rows_version += 1
             st.session_state.coding_queue = []
             st.session_state.coding_result = None
+            st.session_state.stream_job = None
             st.success("Sesi dibersihkan.")
-            st.rerun()
+            st.rerun(scope="fragment")  # antrean & form verifikasi (fragment yang sama) ikut dibersihkan
+
+# Dipanggil setelah semua helper Data & Export terdefinisi (coded_data_section dipakai di dalamnya)
+verification_section()
 
 # =========================
 # Footer